@@ -0,0 +1,109 @@
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Sequence
+
+import db
+import metrics
+import profiling
+
+logger = logging.getLogger(__name__)
+
+# Кількість потоків для запитів до БД (за замовчуванням = розміру пулу з'єднань)
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(db.DB_POOL_SIZE)))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+def _to_async(func):
+    """Wrap a sync db.py function so it runs in the bounded DB executor (with latency metrics)"""
+    timed = metrics.timed_db(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(timed, *args, **kwargs))
+    # Спани профілювання - лише якщо воно увімкнене (інакше жодної зайвої обгортки)
+    return profiling.traced_db(wrapper) if profiling.ENABLED else wrapper
+
+
+def _cached_to_async(func, key: str):
+    """Like _to_async, but answers from db settings cache on the event loop without a thread hop"""
+    wrapped = _to_async(func)
+
+    @functools.wraps(func)
+    async def wrapper():
+        cached = db.get_cached(key)
+        if cached is not db.CACHE_MISS:
+            return cached
+        return await wrapped()
+    return wrapper
+
+
+# --- Async counterparts of db.py API ---
+init_db = _to_async(db.init_db)
+migrate_users_table = _to_async(db.migrate_users_table)
+init_promos_table = _to_async(db.init_promos_table)
+init_weekly_broadcast_table = _to_async(db.init_weekly_broadcast_table)
+
+add_user = _to_async(db.add_user)
+get_user = _to_async(db.get_user)
+get_user_by_phone = _to_async(db.get_user_by_phone)
+get_all_users = _to_async(db.get_all_users)
+get_users_page = _to_async(db.get_users_page)
+get_users_batch = _to_async(db.get_users_batch)
+add_purchase = _to_async(db.add_purchase)
+use_bonus = _to_async(db.use_bonus)
+
+init_purchases_tables = _to_async(db.init_purchases_tables)
+add_purchases_bulk = _to_async(db.add_purchases_bulk)
+get_daily_report = _to_async(db.get_daily_report)
+
+get_promos = _cached_to_async(db.get_promos, "promos")
+get_promos_html = _cached_to_async(db.get_promos_html, "promos_html")
+add_promo = _to_async(db.add_promo)
+delete_promo = _to_async(db.delete_promo)
+clear_promos = _to_async(db.clear_promos)
+update_promo = _to_async(db.update_promo)
+
+set_weekly_broadcast = _to_async(db.set_weekly_broadcast)
+get_weekly_broadcast = _cached_to_async(db.get_weekly_broadcast, "weekly_text")
+set_weekly_time = _to_async(db.set_weekly_time)
+get_weekly_time = _cached_to_async(db.get_weekly_time, "weekly_time")
+
+init_broadcast_jobs_tables = _to_async(db.init_broadcast_jobs_tables)
+create_broadcast_job = _to_async(db.create_broadcast_job)
+get_unfinished_broadcast_jobs = _to_async(db.get_unfinished_broadcast_jobs)
+get_delivered_user_ids = _to_async(db.get_delivered_user_ids)
+record_broadcast_deliveries = _to_async(db.record_broadcast_deliveries)
+get_broadcast_job_stats = _to_async(db.get_broadcast_job_stats)
+finish_broadcast_job = _to_async(db.finish_broadcast_job)
+
+init_admins_table = _to_async(db.init_admins_table)
+get_admin_ids = _cached_to_async(db.get_admin_ids, "admin_ids")
+add_admin = _to_async(db.add_admin)
+remove_admin = _to_async(db.remove_admin)
+
+init_fsm_table = _to_async(db.init_fsm_table)
+get_fsm_record = _to_async(db.get_fsm_record)
+save_fsm_record = _to_async(db.save_fsm_record)
+
+init_leases_table = _to_async(db.init_leases_table)
+acquire_lease = _to_async(db.acquire_lease)
+release_lease = _to_async(db.release_lease)
+
+
+async def iter_users(columns: Sequence[str] = ("user_id",), batch_size: int = 500, after_user_id: int = 0) -> AsyncIterator[tuple]:
+    """Async counterpart of db.iter_users; every page is fetched in the DB executor"""
+    while after_user_id is not None:
+        rows, after_user_id = await get_users_batch(columns, batch_size, after_user_id)
+        for row in rows:
+            yield row
+
+
+def shutdown():
+    """Stop DB executor and close pooled connections (call on application shutdown)"""
+    _executor.shutdown(wait=False)
+    db.close_pool()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Наскрізний бенчмарк бота без мережі: справжній Dispatcher з bot.py або bot_webhook.py,
+локальний фейковий Telegram API (benchmarks/fake_telegram.py) і SQLite з синтетичними гостями.
+
+Відтворює суміш апдейтів (/start, контакт, QR, кешбек, акції, меню, адмінська розсилка)
+через update_queue.UpdateQueue, як у продакшені, і виводить пропускну здатність
+та p50/p95/p99 затримки обробки на кожен обробник.
+
+Запуск:
+    python benchmarks/bench_bot.py --users 10000 --updates 5000
+    python benchmarks/bench_bot.py --entry bot_webhook --users 1000000 --db /tmp/bench_1m.db
+    python benchmarks/bench_bot.py --json result.json --max-p95 50   # код виходу 1, якщо p95 > 50 мс
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN_ID = 1
+FIRST_GUEST_ID = 1_000_000
+
+# Частки апдейтів у суміші (контакт - від нових гостей, решта - від уже зареєстрованих)
+MIX = {
+    "start": 5,
+    "contact": 5,
+    "qr": 20,
+    "cashback": 30,
+    "promos": 15,
+    "menu": 5,
+    "delivery": 4,
+    "booking": 4,
+    "back": 8,
+    "inline_back": 4,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the bot")
+    parser.add_argument("--entry", choices=("bot", "bot_webhook"), default="bot", help="module with Dispatcher")
+    parser.add_argument("--users", type=int, default=10_000, help="synthetic guests in DB")
+    parser.add_argument("--updates", type=int, default=5_000, help="updates to replay")
+    parser.add_argument("--broadcasts", type=int, default=1, help="admin broadcasts to all guests during replay")
+    parser.add_argument("--workers", type=int, default=16, help="UpdateQueue workers")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Telegram API latency, ms")
+    parser.add_argument("--db", help="SQLite file to reuse (seeded once); temporary file by default")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--max-p95", type=float, help="fail (exit 1) if overall p95 is above this, ms")
+    return parser.parse_args()
+
+
+def configure_env(args, db_path: str):
+    """Must run before importing bot modules: they read configuration at import"""
+    os.environ["DATABASE_URL"] = ""
+    os.environ["SQLITE_PATH"] = db_path
+    os.environ["TELEGRAM_TOKEN"] = "123456:BENCHMARK"
+    os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+    os.environ.setdefault("BROADCAST_RATE", "1000000")  # фейковий API не має лімітів
+    os.environ.setdefault("BROADCAST_CONCURRENCY", "50")
+    os.environ.setdefault("LOOP_MONITOR_INTERVAL", "0.1")
+
+
+def seed_users(db, count: int, batch: int = 50_000):
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM users WHERE user_id >= ?", (FIRST_GUEST_ID,))
+        existing = cur.fetchone()[0]
+        if existing >= count:
+            return 0
+        rng = random.Random(count)
+        started = time.perf_counter()
+        for start in range(existing, count, batch):
+            rows = []
+            for i in range(start, min(start + batch, count)):
+                phone = f"+38067{i:07d}"
+                rows.append((FIRST_GUEST_ID + i, phone, rng.randint(0, 2000), rng.randint(0, 60000),
+                             db.normalize_phone(phone)))
+            cur.executemany(
+                "INSERT OR IGNORE INTO users (user_id, phone, bonus_points, total_spent, phone_normalized) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            conn.commit()
+        print(f"Засіяно {count - existing} гостей за {time.perf_counter() - started:.1f} с")
+        return count - existing
+
+
+def prepare_db(db, users: int):
+    """Create all tables, seed guests and a few promos"""
+    from config import ADMIN_IDS
+    for init in (db.init_db, db.init_promos_table, db.init_weekly_broadcast_table, db.init_broadcast_jobs_tables,
+                 db.init_purchases_tables, db.init_fsm_table, db.init_leases_table):
+        init()
+    db.init_admins_table(ADMIN_IDS)
+    seed_users(db, users)
+    if not db.get_promos():
+        for text in ("🍋 -20% на лимонади щопонеділка", "🍕 Друга піца за півціни", "🎂 Десерт у подарунок іменинникам"):
+            db.add_promo(text)
+
+
+def message_update(update_id: int, user_id: int, text: str = None, contact: str = None) -> Dict[str, Any]:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Guest", "username": f"guest{user_id}"},
+    }
+    if text is not None:
+        message["text"] = text
+    if contact is not None:
+        message["contact"] = {"phone_number": contact, "first_name": "Guest", "user_id": user_id}
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> Dict[str, Any]:
+    message = message_update(update_id, user_id, text="🏠 Головне меню:")["message"]
+    message["from"] = {"id": 123456, "is_bot": True, "first_name": "Bench"}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": data, "message": message,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Guest"},
+    }}
+
+
+def build_updates(keyboards, args) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+    kinds, weights = zip(*MIX.items())
+    buttons = {
+        "qr": keyboards.BTN_QR, "cashback": keyboards.BTN_CASHBACK, "promos": keyboards.BTN_PROMOS,
+        "menu": keyboards.BTN_MENU, "delivery": keyboards.BTN_DELIVERY, "booking": keyboards.BTN_BOOKING,
+        "back": keyboards.BTN_BACK,
+    }
+    new_guest = FIRST_GUEST_ID + args.users
+    updates = []
+    for update_id in range(1, args.updates + 1):
+        kind = rng.choices(kinds, weights)[0]
+        guest = FIRST_GUEST_ID + rng.randrange(args.users)
+        if kind == "start":
+            updates.append(message_update(update_id, guest, text="/start"))
+        elif kind == "contact":
+            updates.append(message_update(update_id, new_guest, contact=f"+38093{new_guest % 10_000_000:07d}"))
+            new_guest += 1
+        elif kind == "inline_back":
+            updates.append(callback_update(update_id, guest, "back_to_menu"))
+        else:
+            updates.append(message_update(update_id, guest, text=buttons[kind]))
+
+    # Адмін: кнопка розсилки, потім текст (один чат - порядок зберігає черга)
+    update_id = len(updates)
+    for i in range(args.broadcasts):
+        position = rng.randrange(len(updates) + 1)
+        update_id += 2
+        updates[position:position] = [
+            message_update(update_id - 1, ADMIN_ID, text=keyboards.BTN_ONCE_BROADCAST),
+            message_update(update_id, ADMIN_ID, text=f"Бенчмарк-розсилка {i + 1}"),
+        ]
+    return updates
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def summarize(latencies: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    result = {}
+    everything = sorted(value for values in latencies.values() for value in values)
+    for name, values in sorted(latencies.items(), key=lambda item: -len(item[1])) + [("ALL", everything)]:
+        ordered = sorted(values)
+        result[name] = {
+            "count": len(ordered),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        }
+    return result
+
+
+async def run(args) -> Dict[str, Any]:
+    import importlib
+
+    from fake_telegram import FakeTelegramAPI
+
+    entry = importlib.import_module(args.entry)
+
+    import async_db
+    import broadcast_jobs
+    import db
+    import keyboards
+    import qr
+    from middlewares import handler_name
+    from update_queue import UpdateQueue
+
+    qr.renderer.start()  # процеси рендерингу - до потоків БД
+    prepare_db(db, args.users)
+
+    api = FakeTelegramAPI(latency=args.api_latency / 1000)
+    await api.start()
+    bot = entry.bot
+    await bot.session.close()
+    bot.session = api.session()
+    dp = entry.dp
+
+    names: Dict[int, str] = {}
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def name_middleware(handler, event, data):
+        names[data["event_update"].update_id] = handler_name(data.get("handler"), event, entry.text_router)
+        return await handler(event, data)
+    dp.message.middleware(name_middleware)
+    dp.callback_query.middleware(name_middleware)
+
+    class TimedQueue(UpdateQueue):
+        async def _handle(self, update):
+            started = time.perf_counter()
+            try:
+                return await super()._handle(update)
+            finally:
+                elapsed = time.perf_counter() - started
+                latencies[names.pop(update["update_id"], "unhandled")].append(elapsed)
+
+    updates = build_updates(keyboards, args)
+    queue = TimedQueue(dp, bot, workers=args.workers, maxsize=len(updates) * args.workers)
+    queue.data.update({"dispatcher": dp, "bots": (bot,), **dp.workflow_data})
+    print(f"{args.entry}: {args.users} гостей, {len(updates)} апдейтів, {args.workers} воркерів, "
+          f"API +{args.api_latency} мс")
+
+    queue.start()
+    started = time.perf_counter()
+    for update in updates:
+        queue.put_nowait(update)
+    await queue.stop(timeout=3600)
+    elapsed = time.perf_counter() - started
+
+    broadcast_started = time.perf_counter()
+    if broadcast_jobs._job_tasks:
+        await asyncio.gather(*broadcast_jobs._job_tasks, return_exceptions=True)
+    broadcast_tail = time.perf_counter() - broadcast_started
+
+    await bot.session.close()
+    await api.stop()
+    qr.renderer.shutdown()
+    async_db.shutdown()
+
+    return {
+        "entry": args.entry,
+        "users": args.users,
+        "updates": len(updates),
+        "workers": args.workers,
+        "api_latency_ms": args.api_latency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(len(updates) / elapsed, 1),
+        "broadcast_tail_s": round(broadcast_tail, 3),
+        "api_calls": dict(api.calls),
+        "handlers": summarize(latencies),
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\nПропускна здатність: {result['throughput_ups']} апдейтів/с ({result['elapsed_s']} с)")
+    if result["broadcast_tail_s"] > 0.001:
+        print(f"Розсилки завершились ще через {result['broadcast_tail_s']} с")
+    print(f"Виклики API: {result['api_calls']}\n")
+    print(f"{'обробник':24s} {'к-сть':>7s} {'p50 мс':>9s} {'p95 мс':>9s} {'p99 мс':>9s} {'max мс':>9s}")
+    for name, row in result["handlers"].items():
+        print(f"{name:24s} {row['count']:7d} {row['p50_ms']:9.2f} {row['p95_ms']:9.2f} "
+              f"{row['p99_ms']:9.2f} {row['max_ms']:9.2f}")
+
+
+def main():
+    args = parse_args()
+    tmp = None
+    if args.db:
+        db_path = args.db
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench_bot_")
+        db_path = os.path.join(tmp.name, "bench.db")
+    configure_env(args, db_path)
+    logging.basicConfig(level=logging.WARNING)  # basicConfig у модулях бота тоді нічого не змінить
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if tmp is not None:
+        tmp.cleanup()
+    if args.max_p95 is not None and result["handlers"]["ALL"]["p95_ms"] > args.max_p95:
+        print(f"\n❌ p95 {result['handlers']['ALL']['p95_ms']} мс > {args.max_p95} мс")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
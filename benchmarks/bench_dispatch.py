@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Мікробенчмарк маршрутизації кнопок: ланцюжок фільтрів `lambda m: m.text == ...`
+(як було раніше) проти одного обробника з dict-таблицею (text_router.TextRouter).
+
+Оновлення подаються через dp.feed_update з порожніми обробниками, тому
+вимірюється лише вартість диспетчеризації aiogram.
+
+Запуск: python benchmarks/bench_dispatch.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+import keyboards
+from text_router import TextRouter
+
+N = 5000
+
+BUTTONS = [value for name, value in vars(keyboards).items() if name.startswith("BTN_")]
+
+
+async def noop(message):
+    pass
+
+
+def lambda_chain_dispatcher() -> Dispatcher:
+    """Стара схема: окремий обробник з lambda-фільтром на кожну кнопку"""
+    dp = Dispatcher(storage=MemoryStorage())
+    for text in BUTTONS:
+        dp.message.register(noop, lambda m, text=text: m.text == text)
+    return dp
+
+
+def text_router_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    router = TextRouter()
+    for text in BUTTONS:
+        router.route(text)(noop)
+    router.register(dp)
+    return dp
+
+
+def make_update(update_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message={
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "G"},
+        "text": text,
+    })
+
+
+async def measure(dp: Dispatcher, bot: Bot, updates) -> float:
+    for update in updates[:100]:
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def main():
+    logging.basicConfig(level=logging.WARNING)
+    bot = Bot("123456:BENCHMARK")
+    cases = (
+        ("first button", [BUTTONS[0]]),
+        ("last button", [BUTTONS[-1]]),
+        ("all buttons", BUTTONS),
+        ("free text", ["просто текст"]),
+    )
+    print(f"{len(BUTTONS)} кнопок, {N} оновлень на випадок\n")
+    for case, texts in cases:
+        updates = [make_update(i, texts[i % len(texts)]) for i in range(N)]
+        chain = await measure(lambda_chain_dispatcher(), bot, updates)
+        table = await measure(text_router_dispatcher(), bot, updates)
+        print(f"{case:14s} lambda chain {chain * 1e6:8.1f} мкс   text router {table * 1e6:8.1f} мкс")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
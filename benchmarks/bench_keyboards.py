@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Мікробенчмарк клавіатур: побудова ReplyKeyboardMarkup на кожне повідомлення
+(як було раніше) проти повторного використання готових екземплярів з keyboards.py.
+
+Запуск: python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+import keyboards
+
+N = 20000
+
+
+def build_main_menu(is_admin=False):
+    """Стара реалізація get_main_menu з bot.py"""
+    buttons = [
+        [KeyboardButton(text="📱 Мій QR-код")],
+        [KeyboardButton(text="💰 Кешбек")],
+        [KeyboardButton(text="🍽 Меню закладу")],
+        [KeyboardButton(text="🛵 Доставка")],
+        [KeyboardButton(text="📅 Забронювати столик")],
+        [KeyboardButton(text="🏷 Акції")],
+    ]
+    if is_admin:
+        buttons.insert(0, [KeyboardButton(text="⚙️ Адмін-панель")])
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+
+
+def build_back_menu():
+    """Стара реалізація get_back_menu з bot.py"""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="‹ Повернутись до меню")]],
+        resize_keyboard=True
+    )
+
+
+def allocations(func, n=1000):
+    """Average number of allocated blocks and bytes per call"""
+    func()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = [func() for _ in range(n)]  # noqa: F841 - keep results alive like in a real reply
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    return blocks / n, size / n
+
+
+def main():
+    cases = (
+        ("build per message", lambda: (build_main_menu(False), build_back_menu())),
+        ("prebuilt registry", lambda: (keyboards.get_main_menu(False), keyboards.get_back_menu())),
+    )
+    print(f"Кожне 'повідомлення' = головне меню + меню повернення, {N} ітерацій\n")
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=N, repeat=3))
+        blocks, size = allocations(func)
+        print(f"{name:20s} {seconds / N * 1e6:8.2f} мкс, {blocks:6.1f} блоків, {size:8.0f} байт на повідомлення")
+
+
+if __name__ == "__main__":
+    main()
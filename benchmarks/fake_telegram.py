@@ -0,0 +1,83 @@
+"""
+Локальна заміна Telegram Bot API для бенчмарків (без мережі).
+
+Відповідає на методи, які викликає бот, мінімально коректними об'єктами
+і рахує виклики. Можна додати штучну затримку, щоб імітувати реальний API.
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiohttp import web
+
+BOT_TOKEN = "123456:BENCHMARK"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency: float = 0.0, on_call: Optional[Callable[[str, dict], None]] = None):
+        self.latency = latency
+        self.on_call = on_call  # (method, params) на кожен виклик, напр. щоб зіставити відповідь з апдейтом
+        self.calls: Counter = Counter()
+        self.url: Optional[str] = None
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = await request.post()
+        self.calls[method] += 1
+        if self.on_call is not None:
+            self.on_call(method, data)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat = {"id": int(data.get("chat_id", 1)), "type": "private"}
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            result = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat,
+                      "text": data.get("text", "")}
+        elif method == "sendPhoto":
+            result = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat,
+                      "photo": [{"file_id": f"photo-{chat['id']}", "file_unique_id": f"u{chat['id']}",
+                                 "width": 300, "height": 300}]}
+        elif method == "getUpdates":
+            result = []
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._api)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def session(self) -> AiohttpSession:
+        """Bot session that talks to this server instead of api.telegram.org"""
+        return AiohttpSession(api=TelegramAPIServer.from_base(self.url))
+
+    def bot(self) -> Bot:
+        return Bot(BOT_TOKEN, session=self.session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Генератор навантаження на /webhook (bot_webhook.py) з відкритим циклом.
+
+Апдейти надсилаються за розкладом (i / rate), незалежно від того, чи встиг сервер
+відповісти на попередні, а затримка рахується від запланованого моменту відправки -
+тож черга на сервері не ховається (coordinated omission).
+
+За замовчуванням запускає bot_webhook.py в окремому процесі з SQLite і синтетичними гостями;
+вихідні виклики бота йдуть у фейковий Telegram API (benchmarks/fake_telegram.py) всередині
+цього процесу. Для кожної швидкості вимірюються:
+- ack - відповідь webhook для Telegram (200/503);
+- reply - час до першого виклику API з відповіддю цьому чату (повна обробка апдейту).
+
+Запуск:
+    python benchmarks/loadgen_webhook.py --rates 50,100,200,400 --duration 15
+    python benchmarks/loadgen_webhook.py --queue --rates 200,400,800 --csv curve.csv   # UPDATE_QUEUE=1
+    python benchmarks/loadgen_webhook.py --url http://localhost:8000/webhook --rates 100   # лише ack
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import bench_bot
+from fake_telegram import FakeTelegramAPI
+
+WEBHOOK_PATH = "/webhook"
+# Методи, якими бот відповідає гостю (перший з них завершує апдейт)
+REPLY_METHODS = {"sendMessage", "sendPhoto", "editMessageText", "answerCallbackQuery"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the webhook endpoint")
+    parser.add_argument("--rates", default="25,50,100,200,400", help="updates/s, comma separated")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per rate")
+    parser.add_argument("--grace", type=float, default=10, help="seconds to wait for replies after each step")
+    parser.add_argument("--users", type=int, default=20_000, help="synthetic guests in DB")
+    parser.add_argument("--connections", type=int, default=100, help="max concurrent connections (Telegram uses up to 100)")
+    parser.add_argument("--api-latency", type=float, default=30.0, help="fake Telegram API latency, ms")
+    parser.add_argument("--queue", action="store_true", help="run server with UPDATE_QUEUE=1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--db", help="SQLite file to reuse; temporary file by default")
+    parser.add_argument("--url", help="existing webhook URL (no server is started, only ack latency is measured)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--csv", help="write the curve to this CSV file")
+    # Внутрішнє: режим процесу-сервера
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--api", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# --- Сервер (окремий процес) ---
+
+def serve(args):
+    """bot_webhook.create_app() with bot session pointed at the fake API of the load generator"""
+    bench_bot.configure_env(args, args.db)
+    if args.queue:
+        os.environ["UPDATE_QUEUE"] = "1"
+    os.environ["WEBHOOK_HOST"] = ""
+    logging.basicConfig(level=logging.WARNING)
+
+    import db
+    bench_bot.prepare_db(db, args.users)
+
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiohttp import web
+
+    import bot_webhook
+    bot_webhook.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(args.api))
+    web.run_app(bot_webhook.create_app(), host="127.0.0.1", port=args.port, print=None, access_log=None)
+
+
+async def start_server(args, api_url: str, db_path: str) -> asyncio.subprocess.Process:
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--api", api_url, "--port", str(args.port),
+               "--db", db_path, "--users", str(args.users)]
+    if args.queue:
+        command.append("--queue")
+    return await asyncio.create_subprocess_exec(*command)
+
+
+async def wait_ready(base_url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/health") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Сервер {base_url} не відповів за {timeout} с")
+
+
+# --- Генератор ---
+
+class UpdateFactory:
+    """Endless update mix of bench_bot.MIX; every update goes to its own chat where possible"""
+
+    def __init__(self, users: int, seed: int):
+        import keyboards
+        self.rng = random.Random(seed)
+        self.kinds, self.weights = zip(*bench_bot.MIX.items())
+        self.buttons = {
+            "qr": keyboards.BTN_QR, "cashback": keyboards.BTN_CASHBACK, "promos": keyboards.BTN_PROMOS,
+            "menu": keyboards.BTN_MENU, "delivery": keyboards.BTN_DELIVERY, "booking": keyboards.BTN_BOOKING,
+            "back": keyboards.BTN_BACK,
+        }
+        self.users = users
+        self.update_id = 0
+        self.next_guest = 0
+        self.new_guest = bench_bot.FIRST_GUEST_ID + users
+
+    def next(self):
+        """-> (chat id, update dict)"""
+        self.update_id += 1
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "contact":
+            chat = self.new_guest
+            self.new_guest += 1
+            return chat, bench_bot.message_update(self.update_id, chat, contact=f"+38093{chat % 10_000_000:07d}")
+        chat = bench_bot.FIRST_GUEST_ID + self.next_guest % self.users
+        self.next_guest += 1
+        if kind == "start":
+            return chat, bench_bot.message_update(self.update_id, chat, text="/start")
+        if kind == "inline_back":
+            return chat, bench_bot.callback_update(self.update_id, chat, "back_to_menu")
+        return chat, bench_bot.message_update(self.update_id, chat, text=self.buttons[kind])
+
+
+class ReplyTracker:
+    """Matches the first outgoing API call to a chat with the update sent to it"""
+
+    def __init__(self):
+        self.pending: Dict[int, float] = {}  # chat id -> запланований час відправки
+        self.latencies: List[float] = []
+
+    def expect(self, chat: int, scheduled: float):
+        self.pending[chat] = scheduled
+
+    def on_call(self, method: str, params):
+        if method not in REPLY_METHODS or "chat_id" not in params:
+            return
+        scheduled = self.pending.pop(int(params["chat_id"]), None)
+        if scheduled is not None:
+            self.latencies.append(time.perf_counter() - scheduled)
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_step(session: aiohttp.ClientSession, url: str, factory: UpdateFactory,
+                   tracker: Optional[ReplyTracker], rate: float, duration: float, grace: float) -> Dict[str, float]:
+    total = int(rate * duration)
+    acks: List[float] = []
+    statuses: Counter = Counter()
+    if tracker is not None:
+        tracker.pending.clear()
+        tracker.latencies = []
+
+    async def send(update, scheduled: float):
+        try:
+            async with session.post(url, json=update) as resp:
+                await resp.read()
+                statuses[resp.status] += 1
+        except aiohttp.ClientError as e:
+            statuses[type(e).__name__] += 1
+        acks.append(time.perf_counter() - scheduled)
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(total):
+        scheduled = started + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat, update = factory.next()
+        if tracker is not None:
+            tracker.expect(chat, scheduled)
+        tasks.append(asyncio.create_task(send(update, scheduled)))
+    send_elapsed = time.perf_counter() - started
+    await asyncio.gather(*tasks)
+
+    if tracker is not None:
+        deadline = time.perf_counter() + grace
+        while tracker.pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    acks.sort()
+    ok = statuses.get(200, 0)
+    row = {
+        "target_rate": rate,
+        "offered_rate": round(total / send_elapsed, 1),
+        "sent": total,
+        "ok": ok,
+        "errors": total - ok,
+        "ack_p50_ms": round(percentile(acks, 0.50) * 1000, 1),
+        "ack_p99_ms": round(percentile(acks, 0.99) * 1000, 1),
+    }
+    if tracker is not None:
+        replies = sorted(tracker.latencies)
+        row.update({
+            "replied": len(replies),
+            "reply_rate": round(len(replies) / elapsed, 1),
+            "reply_p50_ms": round(percentile(replies, 0.50) * 1000, 1),
+            "reply_p95_ms": round(percentile(replies, 0.95) * 1000, 1),
+            "reply_p99_ms": round(percentile(replies, 0.99) * 1000, 1),
+        })
+    if total - ok:
+        row["statuses"] = dict(statuses)
+    return row
+
+
+def print_row(row: Dict[str, float]):
+    line = (f"{row['target_rate']:8.0f} {row['offered_rate']:9.1f} {row['ok']:7d} {row['errors']:6d} "
+            f"{row['ack_p50_ms']:9.1f} {row['ack_p99_ms']:9.1f}")
+    if "replied" in row:
+        line += (f" {row['replied']:7d} {row['reply_p50_ms']:9.1f} {row['reply_p95_ms']:9.1f} "
+                 f"{row['reply_p99_ms']:9.1f}")
+    print(line, flush=True)
+    if "statuses" in row:
+        print(f"         статуси: {row['statuses']}")
+
+
+async def main(args):
+    rates = [float(rate) for rate in args.rates.split(",")]
+    tracker = None
+    api = server = tmp = None
+    url = args.url
+    if url is None:
+        tracker = ReplyTracker()
+        api = FakeTelegramAPI(latency=args.api_latency / 1000, on_call=tracker.on_call)
+        api_url = await api.start()
+        if args.db:
+            db_path = args.db
+        else:
+            tmp = tempfile.TemporaryDirectory(prefix="loadgen_")
+            db_path = os.path.join(tmp.name, "loadgen.db")
+        server = await start_server(args, api_url, db_path)
+        base_url = f"http://127.0.0.1:{args.port}"
+        url = base_url + WEBHOOK_PATH
+    else:
+        base_url = url.rsplit("/", 1)[0]
+
+    rows = []
+    try:
+        await wait_ready(base_url)
+        factory = UpdateFactory(args.users, args.seed)
+        mode = "черга (UPDATE_QUEUE=1)" if args.queue else "SimpleRequestHandler"
+        print(f"{url}: {mode}, {args.duration:.0f} с на крок, API +{args.api_latency} мс\n")
+        header = f"{'ціль/с':>8s} {'факт/с':>9s} {'200':>7s} {'помил.':>6s} {'ack p50':>9s} {'ack p99':>9s}"
+        if tracker is not None:
+            header += f" {'відпов.':>7s} {'rep p50':>9s} {'rep p95':>9s} {'rep p99':>9s}"
+        print(header + "   (мс)")
+        connector = aiohttp.TCPConnector(limit=args.connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            for rate in rates:
+                row = await run_step(session, url, factory, tracker, rate, args.duration, args.grace)
+                rows.append(row)
+                print_row(row)
+            # Відповідь зафіксовано на вході в API, а обробники ще чекають на результат - даємо їм завершитись
+            await asyncio.sleep(1 + args.api_latency / 1000)
+    finally:
+        if server is not None:
+            # Фейковий API має працювати, поки сервер зупиняється (on_shutdown викликає deleteWebhook)
+            server.terminate()
+            await server.wait()
+        if api is not None:
+            await api.stop()
+        if tmp is not None:
+            tmp.cleanup()
+
+    if args.csv and rows:
+        fields = [key for key in rows[0] if key != "statuses"]
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.serve:
+        serve(arguments)
+    else:
+        asyncio.run(main(arguments))
@@ -1,19 +1,29 @@
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import CommandStart
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, Contact, CallbackQuery, FSInputFile, BufferedInputFile
 from aiogram.client.default import DefaultBotProperties
 from config import TELEGRAM_TOKEN
-from broadcast import register_broadcast_handlers, start_scheduler, is_admin
+from broadcast import register_broadcast_handlers, start_scheduler
+from config import ADMIN_IDS
+from middlewares import setup_middlewares
+from fsm_storage import DBStorage
 
 import db
+import async_db
+import broadcast_jobs
 import asyncio
 import logging
 import sys
 import os
-import qrcode
-from io import BytesIO
+import qr
+import metrics
+import profiling
+import http_client
+from loop_monitor import monitor as loop_monitor, handle_health
+import keyboards
+from text_router import TextRouter
+from update_queue import UpdateQueue, run_polling
 from aiohttp import web
 
 # Налаштування логування
@@ -26,97 +36,75 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Запити до Telegram йдуть через спільну сесію з keep-alive (http_client.py)
 bot = Bot(
     token=TELEGRAM_TOKEN,
+    session=http_client.SharedAiohttpSession(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
-dp = Dispatcher(storage=MemoryStorage())
+# Стани FSM (адмінські діалоги) зберігаються в БД і переживають перезапуск
+dp = Dispatcher(storage=DBStorage())
+# Кнопки головного меню: один обробник з пошуком за текстом у словнику
+text_router = TextRouter()
+setup_middlewares(dp, text_router)
+profiling.setup_session(bot)
+# Апдейти різних чатів обробляються паралельно, одного чату - по черзі (UPDATE_WORKERS воркерів)
+update_queue = UpdateQueue(dp, bot)
+metrics.register_update_queue(update_queue)
 
 db.init_db()
 db.init_promos_table()
 db.init_weekly_broadcast_table()
+db.init_broadcast_jobs_tables()
+db.init_purchases_tables()
+db.init_admins_table(ADMIN_IDS)
+db.init_fsm_table()
+db.init_leases_table()
 
 # --- Головне меню ---
 def get_main_menu(is_admin=False):
-    buttons = [
-        [KeyboardButton(text="📱 Мій QR-код")],
-        [KeyboardButton(text="💰 Кешбек")],
-        [KeyboardButton(text="🍽 Меню закладу")],
-        [KeyboardButton(text="🛵 Доставка")],
-        [KeyboardButton(text="📅 Забронювати столик")],
-        [KeyboardButton(text="🏷 Акції")],
-    ]
-    if is_admin:
-        buttons.insert(0, [KeyboardButton(text="⚙️ Адмін-панель")])
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    return kb
+    return keyboards.get_main_menu(is_admin)
 
 # --- /start ---
 @dp.message(CommandStart())
 async def cmd_start(message: Message):
-    isadm = is_admin(message)
-    kb = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="📱 Поділитися номером телефону", request_contact=True)]],
-        resize_keyboard=True
-    )
+    kb = keyboards.SHARE_PHONE
     await message.answer(f"Приємно познайомитись, <b>{message.from_user.first_name}</b>!\n\nТакож додайте свій номер телефону, натиснувши на кнопку нижче 👇", reply_markup=kb)
 
 # --- Обробка контакту ---
 @dp.message(lambda m: m.contact is not None)
-async def handle_contact(message: Message):
+async def handle_contact(message: Message, is_admin_user: bool = False):
     phone = message.contact.phone_number
-    db.add_user(message.from_user.id, phone, 0)
-    isadm = is_admin(message)
-    await message.answer("Ваш номер телефону успішно збережено\n\nРеєстрацію завершено!", reply_markup=get_main_menu(is_admin=isadm))
+    await async_db.add_user(message.from_user.id, phone, 0)
+    await message.answer("Ваш номер телефону успішно збережено\n\nРеєстрацію завершено!", reply_markup=get_main_menu(is_admin=is_admin_user))
 
 
 # --- Головне меню ---
-@dp.message(lambda m: m.text == "‹ Повернутись до меню")
-async def back_to_menu(message: Message):
-    isadm = is_admin(message)
-    await message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=isadm))
+@text_router.route(keyboards.BTN_BACK)
+async def back_to_menu(message: Message, is_admin_user: bool = False):
+    await message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=is_admin_user))
 
 
 # --- Кнопка повернення до меню ---
 def get_back_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="‹ Повернутись до меню")]],
-        resize_keyboard=True
-    )
+    return keyboards.BACK_MENU
 
 # --- Показати QR-код ---
-@dp.message(lambda m: m.text == "📱 Мій QR-код")
+@text_router.route(keyboards.BTN_QR)
 async def show_qr(message: Message):
-    user = db.get_user(message.from_user.id)
+    user = await async_db.get_user(message.from_user.id)
     if not user or not user[0]:
         await message.answer("❌ Ви ще не зареєстровані або не вказали номер телефону. Натисніть /start", reply_markup=get_back_menu())
         return
     
     phone = user[0]  # phone is the first element
     
-    # Генерація QR-коду локально
+    # QR-код з кешу (file_id або PNG), рендеринг - поза event loop
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(phone)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Конвертуємо зображення в байти
-        bio = BytesIO()
-        img.save(bio, 'PNG')
-        bio.seek(0)
-        
-        # Відправляємо як BufferedInputFile
-        photo = BufferedInputFile(bio.read(), filename="qr_code.png")
-        await message.answer_photo(
-            photo=photo, 
-            caption=f"📷 Ваш QR-код для нарахування бонусів\n\nНомер: <b>{phone}</b>", 
+        await qr.send_qr(
+            message,
+            phone,
+            caption=f"📷 Ваш QR-код для нарахування бонусів\n\nНомер: <b>{phone}</b>",
             reply_markup=get_back_menu()
         )
     except Exception as e:
@@ -124,9 +112,9 @@ async def show_qr(message: Message):
         await message.answer("❌ Помилка при генерації QR-коду. Спробуйте пізніше.", reply_markup=get_back_menu())
 
 # --- Мій профіль ---
-@dp.message(lambda m: m.text == "💰 Кешбек")
+@text_router.route(keyboards.BTN_CASHBACK)
 async def profile(message: Message):
-    user = db.get_user(message.from_user.id)
+    user = await async_db.get_user(message.from_user.id)
     if not user:
         return await message.answer("❌ Ви ще не зареєстровані. Натисніть /start", reply_markup=get_back_menu())
     
@@ -166,53 +154,34 @@ async def profile(message: Message):
     await message.answer(text, reply_markup=get_back_menu())
 
 # --- Меню закладу ---
-@dp.message(lambda m: m.text == "🍽 Меню закладу")
+@text_router.route(keyboards.BTN_MENU)
 async def menu_link(message: Message):
     text = f"Меню закладу: "
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Меню закладу", url="https://lemon.choiceqr.com/")],
-            [InlineKeyboardButton(text="‹ Повернутись до меню", callback_data="back_to_menu")]
-        ]
-    )
+    kb = keyboards.MENU_LINK_INLINE
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
 # --- Доставка ---
-@dp.message(lambda m: m.text == "🛵 Доставка")
+@text_router.route(keyboards.BTN_DELIVERY)
 async def delivery(message: Message):
     text = "Доставка доступна через Bolt Food!"
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Bolt Food", url="https://food.bolt.eu/en-US/990/p/134325-lemon?utm_source=share_provider&utm_medium=product&utm_content=menu_header")],
-            [InlineKeyboardButton(text="‹ Повернутись до меню", callback_data="back_to_menu")]
-        ]
-    )
+    kb = keyboards.DELIVERY_INLINE
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
 # --- Забронювати столик ---
-@dp.message(lambda m: m.text == "📅 Забронювати столик")
+@text_router.route(keyboards.BTN_BOOKING)
 async def book_table(message: Message):
     text = (
         "Забронювати столик можна за номером телефону: <b>+380 68 123 43 45</b>\n"
         "або написати в дірект Instagram."
     )
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Скопіювати номер", callback_data="copy_phone")],
-            [InlineKeyboardButton(text="Instagram", url="https://www.instagram.com/lemon.gastrobar.if?igsh=emxlN3dnZW11dWJ4")],
-            [InlineKeyboardButton(text="‹ Повернутись до меню", callback_data="back_to_menu")]
-        ]
-    )
+    kb = keyboards.BOOKING_INLINE
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
 # --- Акції ---
-@dp.message(lambda m: m.text == "🏷 Акції")
+@text_router.route(keyboards.BTN_PROMOS)
 async def show_promos(message: Message):
-    promos = db.get_promos()
-    if promos:
-        text = "<b>Актуальні акції:</b>\n"
-        for pid, promo in promos:
-            text += f"\n{pid}. {promo}"
+    text = await async_db.get_promos_html()
+    if text:
         await message.answer(text, reply_markup=get_back_menu())
     else:
         await message.answer("Зараз немає актуальних акцій.", reply_markup=get_back_menu())
@@ -220,10 +189,9 @@ async def show_promos(message: Message):
 # --Обробник inline-кнопок
 # --- Обробка callback для повернення до меню з inline-кнопки ---
 @dp.callback_query(lambda c: c.data == "back_to_menu")
-async def inline_back_to_menu(callback: CallbackQuery):
-    isadm = is_admin(callback.message)
+async def inline_back_to_menu(callback: CallbackQuery, is_admin_user: bool = False):
     await callback.message.edit_text("🏠 Головне меню:", reply_markup=None)
-    await callback.message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=isadm))
+    await callback.message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=is_admin_user))
 
 # --- Обробка callback для копіювання номера телефону ---
 @dp.callback_query(lambda c: c.data == "copy_phone")
@@ -231,6 +199,10 @@ async def copy_phone_callback(callback: CallbackQuery):
     await callback.answer("Номер скопійовано!", show_alert=True)
     await callback.message.answer("+380681234345")
 
+# --- Адмін-обробники (стани FSM) і, останньою, таблиця кнопок ---
+register_broadcast_handlers(dp, bot, get_main_menu, text_router)
+text_router.register(dp)
+
 # --- HTTP Health Check Endpoint ---
 async def health_check(request):
     """Health check endpoint для Koyeb"""
@@ -240,7 +212,9 @@ async def start_web_server(port: int):
     """Запуск веб-сервера для health check"""
     app = web.Application()
     app.router.add_get('/', health_check)
-    app.router.add_get('/health', health_check)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', metrics.handle_metrics)
+    app.router.add_get('/queue', lambda request: web.json_response(update_queue.stats()))
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -253,25 +227,35 @@ async def main():
     logger.info("Бот запускається...")
     port = int(os.getenv("PORT", 8000))
     
+    # Процеси для рендерингу QR-кодів запускаємо до старту інших потоків
+    qr.renderer.start()
+    loop_monitor.start()
+    
     # Запускаємо HTTP сервер для health check
     runner = await start_web_server(port)
     
     max_retries = 5
     retry_delay = 10
+    jobs_resumed = False
     
     for attempt in range(max_retries):
         try:
             logger.info(f"Спроба підключення {attempt + 1}/{max_retries}")
-            register_broadcast_handlers(dp, bot, get_main_menu)
             start_scheduler(bot)
             
             # Тест підключення до Telegram з кастомним timeout
             logger.info("Тестування підключення до Telegram API...")
             me = await asyncio.wait_for(bot.get_me(), timeout=30.0)
             logger.info(f"Бот успішно підключений: @{me.username}")
+            
+            # Продовжуємо розсилки, перервані перезапуском
+            if not jobs_resumed:
+                await broadcast_jobs.resume_unfinished_jobs(bot)
+                broadcast_jobs.start_resume_loop(bot)
+                jobs_resumed = True
             logger.info("Бот готовий до роботи")
             
-            await dp.start_polling(bot, polling_timeout=20, request_timeout=30)
+            await run_polling(dp, bot, queue=update_queue, polling_timeout=20)
             break
             
         except asyncio.TimeoutError:
@@ -293,8 +277,14 @@ async def main():
                 logger.error("Всі спроби підключення невдалі")
                 raise
     
-    # Cleanup
+    # Cleanup: розсилки зупиняються і звільняють оренди до закриття БД
+    await broadcast_jobs.shutdown()
     await runner.cleanup()
+    await http_client.close()
+    await profiling.profiler.flush()
+    await loop_monitor.stop()
+    qr.renderer.shutdown()
+    async_db.shutdown()
 
 if __name__ == "__main__":
     logger.info(f"Запуск бота...")
@@ -1,20 +1,33 @@
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import CommandStart
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, Contact, CallbackQuery, FSInputFile, BufferedInputFile
 from aiogram.client.default import DefaultBotProperties
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from config import TELEGRAM_TOKEN
-from broadcast import register_broadcast_handlers, start_scheduler, is_admin
+from broadcast import register_broadcast_handlers, start_scheduler
+from config import ADMIN_IDS
+from middlewares import setup_middlewares
+from fsm_storage import DBStorage, FSM_CACHE_TTL
 
 import db
+import async_db
+import broadcast_jobs
+import leases
+import multiprocessing
+import signal
 import asyncio
 import logging
 import sys
 import os
-import qrcode
-from io import BytesIO
+import qr
+import metrics
+import profiling
+import http_client
+from loop_monitor import monitor as loop_monitor, handle_health
+import keyboards
+from text_router import TextRouter
+from update_queue import QueuedRequestHandler
 from aiohttp import web
 import aiohttp
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -38,6 +51,21 @@ WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 logger.info(f"WEBHOOK_HOST: {WEBHOOK_HOST}")
 logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
 
+# Масштабування: кількість процесів-воркерів на цьому інстансі (спільний порт через SO_REUSEPORT)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+# Кілька реплік або воркерів: webhook не видаляється при зупинці, стани FSM читаються з БД без кешу,
+# кеші налаштувань і телефонів живуть лише кілька секунд
+MULTI_INSTANCE = os.getenv("MULTI_INSTANCE", "").lower() in ("1", "true", "yes") or WEBHOOK_WORKERS > 1
+# Зміни з інших процесів (адміни, акції, тижнева розсилка) не скидають кеш цього процесу
+MULTI_INSTANCE_CACHE_TTL = float(os.getenv("MULTI_INSTANCE_CACHE_TTL", "5"))
+if MULTI_INSTANCE:
+    db.set_cache_ttl(MULTI_INSTANCE_CACHE_TTL)
+KEEP_ALIVE_INTERVAL = 2  # хвилин
+KEEP_ALIVE_TIMEOUT = 30  # секунд
+# Режим черги: webhook лише кладе апдейт у чергу і одразу відповідає Telegram,
+# обробка - пулом воркерів зі збереженням порядку в межах чату (UPDATE_WORKERS, UPDATE_QUEUE_SIZE)
+UPDATE_QUEUE = os.getenv("UPDATE_QUEUE", "").lower() in ("1", "true", "yes")
+
 # Перевірка URL
 if not WEBHOOK_HOST:
     logger.error("❌ WEBHOOK_HOST не встановлено!")
@@ -46,11 +74,18 @@ elif not WEBHOOK_HOST.startswith("https://"):
 else:
     logger.info("✅ WEBHOOK_HOST налаштовано правильно")
 
+# Запити до Telegram йдуть через спільну сесію з keep-alive (http_client.py)
 bot = Bot(
     token=TELEGRAM_TOKEN,
+    session=http_client.SharedAiohttpSession(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
-dp = Dispatcher(storage=MemoryStorage())
+# Стани FSM (адмінські діалоги) зберігаються в БД і переживають перезапуск
+dp = Dispatcher(storage=DBStorage(cache_ttl=0 if MULTI_INSTANCE else FSM_CACHE_TTL))
+# Кнопки головного меню: один обробник з пошуком за текстом у словнику
+text_router = TextRouter()
+setup_middlewares(dp, text_router)
+profiling.setup_session(bot)
 
 # Ініціалізація БД відключена, бо таблиці вже створені в Supabase
 # db.init_db()
@@ -60,21 +95,10 @@ logger.info("⚠️ Ініціалізація БД пропущена (табл
 
 # --- Головне меню ---
 def get_main_menu(is_admin=False):
-    buttons = [
-        [KeyboardButton(text="📱 Мій QR-код")],
-        [KeyboardButton(text="💰 Кешбек")],
-        [KeyboardButton(text="🍽 Меню закладу")],
-        [KeyboardButton(text="🛵 Доставка")],
-        [KeyboardButton(text="📅 Забронювати столик")],
-        [KeyboardButton(text="🏷 Акції")],
-    ]
-    if is_admin:
-        buttons.insert(0, [KeyboardButton(text="⚙️ Адмін-панель")])
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    return kb
+    return keyboards.get_main_menu(is_admin)
 
 # Реєструємо broadcast обробники ПЕРЕД іншими обробниками
-register_broadcast_handlers(dp, bot, get_main_menu)
+register_broadcast_handlers(dp, bot, get_main_menu, text_router)
 logger.info("✅ Broadcast handlers зареєстровано")
 
 # --- /start ---
@@ -82,11 +106,7 @@ logger.info("✅ Broadcast handlers зареєстровано")
 async def cmd_start(message: Message):
     logger.info(f"👤 /start від користувача {message.from_user.id} (@{message.from_user.username})")
     try:
-        isadm = is_admin(message)
-        kb = ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="📱 Поділитися номером телефону", request_contact=True)]],
-            resize_keyboard=True
-        )
+        kb = keyboards.SHARE_PHONE
         await message.answer(f"Приємно познайомитись, <b>{message.from_user.first_name}</b>!\n\nТакож додайте свій номер телефону, натиснувши на кнопку нижче 👇", reply_markup=kb)
         logger.info(f"✅ Відповідь на /start відправлено користувачу {message.from_user.id}")
     except Exception as e:
@@ -94,66 +114,44 @@ async def cmd_start(message: Message):
 
 # --- Обробка контакту ---
 @dp.message(lambda m: m.contact is not None)
-async def handle_contact(message: Message):
+async def handle_contact(message: Message, is_admin_user: bool = False):
     logger.info(f"📞 Отримано контакт від користувача {message.from_user.id}")
     try:
         phone = message.contact.phone_number
-        db.add_user(message.from_user.id, phone, 0)
-        isadm = is_admin(message)
-        await message.answer("Ваш номер телефону успішно збережено\n\nРеєстрацію завершено!", reply_markup=get_main_menu(is_admin=isadm))
+        await async_db.add_user(message.from_user.id, phone, 0)
+        await message.answer("Ваш номер телефону успішно збережено\n\nРеєстрацію завершено!", reply_markup=get_main_menu(is_admin=is_admin_user))
         logger.info(f"✅ Контакт збережено для користувача {message.from_user.id}")
     except Exception as e:
         logger.error(f"❌ Помилка в handle_contact: {e}", exc_info=True)
 
 
 # --- Головне меню ---
-@dp.message(lambda m: m.text == "‹ Повернутись до меню")
-async def back_to_menu(message: Message):
-    isadm = is_admin(message)
-    await message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=isadm))
+@text_router.route(keyboards.BTN_BACK)
+async def back_to_menu(message: Message, is_admin_user: bool = False):
+    await message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=is_admin_user))
 
 
 # --- Кнопка повернення до меню ---
 def get_back_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="‹ Повернутись до меню")]],
-        resize_keyboard=True
-    )
+    return keyboards.BACK_MENU
 
 # --- Показати QR-код ---
-@dp.message(lambda m: m.text == "📱 Мій QR-код")
+@text_router.route(keyboards.BTN_QR)
 async def show_qr(message: Message):
     logger.info(f"📱 QR-код запит від користувача {message.from_user.id}")
     try:
-        user = db.get_user(message.from_user.id)
+        user = await async_db.get_user(message.from_user.id)
         if not user or not user[0]:
             await message.answer("❌ Ви ще не зареєстровані або не вказали номер телефону. Натисніть /start", reply_markup=get_back_menu())
             return
         
         phone = user[0]  # phone is the first element
         
-        # Генерація QR-коду локально
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(phone)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Конвертуємо зображення в байти
-        bio = BytesIO()
-        img.save(bio, 'PNG')
-        bio.seek(0)
-        
-        # Відправляємо як BufferedInputFile
-        photo = BufferedInputFile(bio.read(), filename="qr_code.png")
-        await message.answer_photo(
-            photo=photo, 
-            caption=f"📷 Ваш QR-код для нарахування бонусів\n\nНомер: <b>{phone}</b>", 
+        # QR-код з кешу (file_id або PNG), рендеринг - поза event loop
+        await qr.send_qr(
+            message,
+            phone,
+            caption=f"📷 Ваш QR-код для нарахування бонусів\n\nНомер: <b>{phone}</b>",
             reply_markup=get_back_menu()
         )
         logger.info(f"✅ QR-код відправлено користувачу {message.from_user.id}")
@@ -162,9 +160,9 @@ async def show_qr(message: Message):
         await message.answer("❌ Помилка при генерації QR-коду. Спробуйте пізніше.", reply_markup=get_back_menu())
 
 # --- Мій профіль ---
-@dp.message(lambda m: m.text == "💰 Кешбек")
+@text_router.route(keyboards.BTN_CASHBACK)
 async def profile(message: Message):
-    user = db.get_user(message.from_user.id)
+    user = await async_db.get_user(message.from_user.id)
     if not user:
         return await message.answer("❌ Ви ще не зареєстровані. Натисніть /start", reply_markup=get_back_menu())
     
@@ -204,63 +202,43 @@ async def profile(message: Message):
     await message.answer(text, reply_markup=get_back_menu())
 
 # --- Меню закладу ---
-@dp.message(lambda m: m.text == "🍽 Меню закладу")
+@text_router.route(keyboards.BTN_MENU)
 async def menu_link(message: Message):
     text = f"Меню закладу: "
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Меню закладу", url="https://lemon.choiceqr.com/")],
-            [InlineKeyboardButton(text="‹ Повернутись до меню", callback_data="back_to_menu")]
-        ]
-    )
+    kb = keyboards.MENU_LINK_INLINE
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
 # --- Доставка ---
-@dp.message(lambda m: m.text == "🛵 Доставка")
+@text_router.route(keyboards.BTN_DELIVERY)
 async def delivery(message: Message):
     text = "Доставка доступна через Bolt Food!"
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Bolt Food", url="https://food.bolt.eu/en-US/990/p/134325-lemon?utm_source=share_provider&utm_medium=product&utm_content=menu_header")],
-            [InlineKeyboardButton(text="‹ Повернутись до меню", callback_data="back_to_menu")]
-        ]
-    )
+    kb = keyboards.DELIVERY_INLINE
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
 # --- Забронювати столик ---
-@dp.message(lambda m: m.text == "📅 Забронювати столик")
+@text_router.route(keyboards.BTN_BOOKING)
 async def book_table(message: Message):
     text = (
         "Забронювати столик можна за номером телефону: <b>+380 68 123 43 45</b>\n"
         "або написати в дірект Instagram."
     )
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Скопіювати номер", callback_data="copy_phone")],
-            [InlineKeyboardButton(text="Instagram", url="https://www.instagram.com/lemon.gastrobar.if?igsh=emxlN3dnZW11dWJ4")],
-            [InlineKeyboardButton(text="‹ Повернутись до меню", callback_data="back_to_menu")]
-        ]
-    )
+    kb = keyboards.BOOKING_INLINE
     await message.answer(text, reply_markup=kb, disable_web_page_preview=True)
 
 # --- Акції ---
-@dp.message(lambda m: m.text == "🏷 Акції")
+@text_router.route(keyboards.BTN_PROMOS)
 async def show_promos(message: Message):
-    promos = db.get_promos()
-    if promos:
-        text = "<b>Актуальні акції:</b>\n"
-        for pid, promo in promos:
-            text += f"\n{pid}. {promo}"
+    text = await async_db.get_promos_html()
+    if text:
         await message.answer(text, reply_markup=get_back_menu())
     else:
         await message.answer("Зараз немає актуальних акцій.", reply_markup=get_back_menu())
 
 # --- Обробка callback для повернення до меню з inline-кнопки ---
 @dp.callback_query(lambda c: c.data == "back_to_menu")
-async def inline_back_to_menu(callback: CallbackQuery):
-    isadm = is_admin(callback.message)
+async def inline_back_to_menu(callback: CallbackQuery, is_admin_user: bool = False):
     await callback.message.edit_text("🏠 Головне меню:", reply_markup=None)
-    await callback.message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=isadm))
+    await callback.message.answer("🏠 Головне меню:", reply_markup=get_main_menu(is_admin=is_admin_user))
 
 # --- Обробка callback для копіювання номера телефону ---
 @dp.callback_query(lambda c: c.data == "copy_phone")
@@ -269,6 +247,9 @@ async def copy_phone_callback(callback: CallbackQuery):
     await callback.answer("Номер скопійовано!", show_alert=True)
     await callback.message.answer("+380681234345")
 
+# --- Таблиця кнопок реєструється останньою: стани FSM і контакт мають пріоритет ---
+text_router.register(dp)
+
 # --- Health Check ---
 async def health_check(request):
     """Health check endpoint для Koyeb"""
@@ -277,14 +258,16 @@ async def health_check(request):
 # --- Keep-Alive функція ---
 async def keep_alive_ping():
     """Періодичний ping щоб сервер не засинав"""
-    if WEBHOOK_HOST:
+    # Достатньо одного ping на інтервал від усіх реплік
+    if WEBHOOK_HOST and await leases.try_acquire("keep_alive", ttl=KEEP_ALIVE_INTERVAL * 60 - 10):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{WEBHOOK_HOST}/health") as resp:
-                    if resp.status == 200:
-                        logger.debug("✅ Keep-alive ping successful")
-                    else:
-                        logger.warning(f"⚠️ Keep-alive ping returned status {resp.status}")
+            # Спільна сесія: з'єднання з попереднього ping перевикористовується без нового TLS-рукостискання
+            session = await http_client.get_session()
+            async with session.get(f"{WEBHOOK_HOST}/health", timeout=aiohttp.ClientTimeout(total=KEEP_ALIVE_TIMEOUT)) as resp:
+                if resp.status == 200:
+                    logger.debug("✅ Keep-alive ping successful")
+                else:
+                    logger.warning(f"⚠️ Keep-alive ping returned status {resp.status}")
         except Exception as e:
             logger.error(f"❌ Keep-alive ping failed: {e}")
 
@@ -294,26 +277,43 @@ async def on_startup(app):
     logger.info(f"WEBHOOK_HOST: {WEBHOOK_HOST}")
     logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
     
+    # Процеси для рендерингу QR-кодів запускаємо до старту інших потоків
+    qr.renderer.start()
+    loop_monitor.start()
+    
+    # Існуюча таблиця users доповнюється новими колонками (phone_normalized) та індексом;
+    # без цього реєстрація гостя (add_user) не спрацює
+    await async_db.migrate_users_table()
+    # Нові таблиці (розсилки, журнал покупок, адміни, стани FSM) створюються, якщо їх ще немає
+    await async_db.init_broadcast_jobs_tables()
+    await async_db.init_purchases_tables()
+    await async_db.init_admins_table(ADMIN_IDS)
+    await async_db.init_fsm_table()
+    await async_db.init_leases_table()
+    
     # Запускаємо scheduler для тижневої розсилки
     start_scheduler(bot)
     
     # Запускаємо keep-alive scheduler
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(keep_alive_ping, 'interval', minutes=2)  # Ping кожні 2 хвилини
+    scheduler.add_job(keep_alive_ping, 'interval', minutes=KEEP_ALIVE_INTERVAL)
     scheduler.start()
-    logger.info("🔄 Keep-alive scheduler запущено (ping кожні 2 хвилин)")
+    logger.info(f"🔄 Keep-alive scheduler запущено (ping кожні {KEEP_ALIVE_INTERVAL} хвилин)")
     
-    # Встановлюємо webhook
+    # Встановлюємо webhook (тільки якщо він ще не вказує сюди - інші репліки/воркери вже могли це зробити)
     if WEBHOOK_HOST:
         try:
-            await bot.set_webhook(
-                url=WEBHOOK_URL,
-                drop_pending_updates=True
-            )
-            logger.info(f"✅ Webhook встановлено: {WEBHOOK_URL}")
+            webhook_info = await bot.get_webhook_info()
+            # Кілька воркерів стартують одночасно: встановлює (і скидає старі апдейти) лише один
+            if webhook_info.url != WEBHOOK_URL and (not MULTI_INSTANCE or await leases.try_acquire("set_webhook", ttl=60)):
+                await bot.set_webhook(
+                    url=WEBHOOK_URL,
+                    drop_pending_updates=True
+                )
+                logger.info(f"✅ Webhook встановлено: {WEBHOOK_URL}")
+                webhook_info = await bot.get_webhook_info()
             
             # Перевіряємо статус webhook
-            webhook_info = await bot.get_webhook_info()
             logger.info(f"📊 Webhook info: url={webhook_info.url}, pending_update_count={webhook_info.pending_update_count}")
             if webhook_info.last_error_message:
                 logger.error(f"❌ Останя помилка webhook: {webhook_info.last_error_message}")
@@ -321,30 +321,47 @@ async def on_startup(app):
             logger.error(f"❌ Помилка встановлення webhook: {e}", exc_info=True)
     else:
         logger.warning("⚠️ WEBHOOK_HOST не встановлено, бот працюватиме без webhook")
+    
+    # Продовжуємо розсилки, перервані перезапуском, і періодично підхоплюємо ті, чия оренда
+    # ще була зайнята (процес, що впав, або інший інстанс)
+    resumed = await broadcast_jobs.resume_unfinished_jobs(bot)
+    if resumed:
+        logger.info(f"🔁 Відновлено розсилок: {resumed}")
+    broadcast_jobs.start_resume_loop(bot)
 
 async def on_shutdown(app):
     """Викликається при зупинці"""
     logger.info("Зупинка бота...")
-    await bot.delete_webhook()
+    # Розсилки зупиняються і звільняють оренди, поки працюють БД і сесія бота
+    await broadcast_jobs.shutdown()
+    if not MULTI_INSTANCE:
+        await bot.delete_webhook()
     await bot.session.close()
+    await http_client.close()
+    await profiling.profiler.flush()
+    await loop_monitor.stop()
+    qr.renderer.shutdown()
+    async_db.shutdown()
 
-def main():
-    """Головна функція запуску"""
-    port = int(os.getenv("PORT", 8000))
-    logger.info(f"🚀 Запуск веб-сервера на порту {port}")
-    
-    # Створюємо aiohttp додаток
+def create_app():
+    """Створює aiohttp додаток з webhook та health check"""
     app = web.Application()
     
     # Health check endpoints
     app.router.add_get('/', health_check)
-    app.router.add_get('/health', health_check)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', metrics.handle_metrics)
     
     # Webhook handler
-    webhook_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot
-    )
+    if UPDATE_QUEUE:
+        webhook_handler = QueuedRequestHandler(dispatcher=dp, bot=bot)
+        metrics.register_update_queue(webhook_handler.queue)
+        app.router.add_get('/queue', lambda request: web.json_response(webhook_handler.queue.stats()))
+    else:
+        webhook_handler = SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot
+        )
     webhook_handler.register(app, path=WEBHOOK_PATH)
     
     # Startup/shutdown callbacks
@@ -356,9 +373,38 @@ def main():
     for route in app.router.routes():
         logger.info(f"  {route.method} {route.resource}")
     
-    # Запускаємо сервер
     setup_application(app, dp, bot=bot)
-    web.run_app(app, host='0.0.0.0', port=port)
+    return app
+
+def run_worker(port: int, reuse_port: bool = False):
+    """Запуск веб-сервера в поточному процесі"""
+    web.run_app(create_app(), host='0.0.0.0', port=port, reuse_port=reuse_port)
+
+def main():
+    """Головна функція запуску"""
+    port = int(os.getenv("PORT", 8000))
+    if WEBHOOK_WORKERS <= 1:
+        logger.info(f"🚀 Запуск веб-сервера на порту {port}")
+        run_worker(port)
+        return
+    
+    # Кілька процесів слухають один порт, ядро розподіляє з'єднання між ними
+    logger.info(f"🚀 Запуск {WEBHOOK_WORKERS} воркерів на порту {port}")
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(port, True), name=f"webhook-worker-{i}")
+        for i in range(WEBHOOK_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    def stop_workers(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+    signal.signal(signal.SIGTERM, stop_workers)
+    
+    for worker in workers:
+        worker.join()
 
 if __name__ == "__main__":
     try:
@@ -1,20 +1,20 @@
+from aiogram import Bot
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from config import ADMIN_USERNAMES
+from aiogram.filters import Command, CommandObject
 import db
+import async_db
+import broadcast_jobs
+import leases
+import qr
+import keyboards
 import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import logging
 
 logger = logging.getLogger(__name__)
 
-def is_admin(message: Message):
-    username = message.from_user.username
-    is_admin_user = username in ADMIN_USERNAMES
-    logger.info(f"🔐 Перевірка адміна: username='{username}', ADMIN_USERNAMES={ADMIN_USERNAMES}, is_admin={is_admin_user}")
-    return is_admin_user
-
 class AdminStates(StatesGroup):
     waiting_for_broadcast = State()
     waiting_for_weekly_text = State()
@@ -27,26 +27,80 @@ class AdminStates(StatesGroup):
     waiting_for_delete_promo_id = State()
 
 # --- FSM та хендлери для розсилок та адмін-панелі ---
-def register_broadcast_handlers(dp, bot, get_main_menu):
-    @dp.message(lambda m: m.text == "⚙️ Адмін-панель")
-    async def admin_panel(message: Message):
-        if not is_admin(message):
+# is_admin_user підставляє middlewares.AdminMiddleware (один раз на апдейт)
+def register_broadcast_handlers(dp, bot, get_main_menu, text_router):
+    @text_router.route(keyboards.BTN_ADMIN_PANEL)
+    async def admin_panel(message: Message, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
-        kb = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="📢 Одноразова розсилка")],
-                [KeyboardButton(text="🔁 Тижнева розсилка")],
-                [KeyboardButton(text="✏️ Редагувати текст тижневої розсилки")],
-                [KeyboardButton(text="⏰ Редагувати час тижневої розсилки")],
-                [KeyboardButton(text="📝 Редагувати акції")],
-                [KeyboardButton(text="‹ Повернутись до меню")],
-            ], resize_keyboard=True
-        )
+        kb = keyboards.ADMIN_PANEL
         await message.answer("Адмін-панель:", reply_markup=kb)
 
-    @dp.message(lambda m: m.text == "⏰ Редагувати час тижневої розсилки")
-    async def edit_weekly_time(message: Message, state: FSMContext):
-        if not is_admin(message):
+    @dp.message(Command("prerender_qr"))
+    async def prerender_qr(message: Message, bot: Bot, is_admin_user: bool = False):
+        if not is_admin_user:
+            return await message.answer("⛔️ Доступ заборонено.")
+        if not qr.QR_CACHE_DIR:
+            # Без диска згенеровані коди вмістилися б лише в QR_CACHE_SIZE записів кешу в пам'яті
+            return await message.answer("⚠️ Попередня генерація потребує дискового кешу: задайте QR_CACHE_DIR.")
+        await message.answer("🖨 Генерація QR-кодів для всіх гостей розпочата у фоні.")
+
+        async def run():
+            try:
+                rendered = await qr.prerender_all()
+                await bot.send_message(message.chat.id, f"✅ QR-коди згенеровано: {rendered}")
+            except Exception as e:
+                logger.error(f"❌ Помилка генерації QR-кодів: {e}", exc_info=True)
+                await bot.send_message(message.chat.id, "❌ Помилка генерації QR-кодів.")
+
+        task = asyncio.create_task(run())
+        _scheduled_tasks.add(task)
+        task.add_done_callback(_scheduled_tasks.discard)
+
+    # --- Керування адмінами (за Telegram user ID, таблиця admins) ---
+    @dp.message(Command("admins"))
+    async def list_admins(message: Message, is_admin_user: bool = False):
+        if not is_admin_user:
+            return await message.answer("⛔️ Доступ заборонено.")
+        admin_ids = sorted(await async_db.get_admin_ids())
+        listed = "\n".join(f"• <code>{admin_id}</code>" for admin_id in admin_ids) or "порожньо"
+        await message.answer(
+            f"👥 Адміни (за ID):\n{listed}\n\n"
+            "Додати: /add_admin &lt;user_id&gt; [username]\nВидалити: /remove_admin &lt;user_id&gt;"
+        )
+
+    @dp.message(Command("add_admin"))
+    async def add_admin(message: Message, command: CommandObject, is_admin_user: bool = False):
+        if not is_admin_user:
+            return await message.answer("⛔️ Доступ заборонено.")
+        args = (command.args or "").split()
+        if not args or not args[0].lstrip("-").isdigit():
+            return await message.answer("Використання: /add_admin &lt;user_id&gt; [username]")
+        user_id = int(args[0])
+        username = args[1].lstrip("@") if len(args) > 1 else None
+        if await async_db.add_admin(user_id, username):
+            await message.answer(f"✅ Адміна <code>{user_id}</code> додано.")
+        else:
+            await message.answer("❌ Не вдалося додати адміна.")
+
+    @dp.message(Command("remove_admin"))
+    async def remove_admin(message: Message, command: CommandObject, is_admin_user: bool = False):
+        if not is_admin_user:
+            return await message.answer("⛔️ Доступ заборонено.")
+        args = (command.args or "").split()
+        if not args or not args[0].lstrip("-").isdigit():
+            return await message.answer("Використання: /remove_admin &lt;user_id&gt;")
+        user_id = int(args[0])
+        if user_id == message.from_user.id:
+            return await message.answer("⚠️ Не можна видалити самого себе.")
+        if await async_db.remove_admin(user_id):
+            await message.answer(f"✅ Адміна <code>{user_id}</code> видалено.")
+        else:
+            await message.answer(f"❌ <code>{user_id}</code> не знайдено серед адмінів.")
+
+    @text_router.route(keyboards.BTN_EDIT_WEEKLY_TIME)
+    async def edit_weekly_time(message: Message, state: FSMContext, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
         days_hint = (
             "0 = неділя\n"
@@ -63,105 +117,79 @@ def register_broadcast_handlers(dp, bot, get_main_menu):
         await state.set_state(AdminStates.waiting_for_time)
 
     @dp.message(AdminStates.waiting_for_time)
-    async def save_weekly_time(message: Message, state: FSMContext):
+    async def save_weekly_time(message: Message, state: FSMContext, is_admin_user: bool = False):
         try:
             parts = message.text.strip().split()
             day = int(parts[0])
             hour, minute = map(int, parts[1].split(":"))
-            db.set_weekly_time(day, hour, minute)
-            await message.answer(f"Час тижневої розсилки збережено: {day} {hour:02d}:{minute:02d}", reply_markup=get_main_menu(is_admin=is_admin(message)))
+            await async_db.set_weekly_time(day, hour, minute)
+            await message.answer(f"Час тижневої розсилки збережено: {day} {hour:02d}:{minute:02d}", reply_markup=get_main_menu(is_admin=is_admin_user))
             await state.clear()
         except Exception:
             await message.answer("Невірний формат. Спробуйте ще раз: день_тижня година:хвилина")
 
-    @dp.message(lambda m: m.text == "📢 Одноразова розсилка")
-    async def once_broadcast(message: Message, state: FSMContext):
-        if not is_admin(message):
+    @text_router.route(keyboards.BTN_ONCE_BROADCAST)
+    async def once_broadcast(message: Message, state: FSMContext, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
         await message.answer("Введіть текст для одноразової розсилки:")
         await state.set_state(AdminStates.waiting_for_broadcast)
 
     @dp.message(AdminStates.waiting_for_broadcast)
-    async def send_once_broadcast(message: Message, state: FSMContext):
-        users = db.get_all_users()
-        sent = 0
-        failed = 0
-        for user in users:
-            try:
-                await bot.send_message(user[0], message.text)
-                sent += 1
-            except Exception:
-                failed += 1
-        await message.answer(f"Розсилку надіслано. Успішно: {sent}, помилок: {failed}.", reply_markup=get_main_menu(is_admin=is_admin(message)))
+    async def send_once_broadcast(message: Message, state: FSMContext, bot: Bot, is_admin_user: bool = False):
         await state.clear()
+        await message.answer("📨 Розсилку розпочато. Звіт надійде після завершення.", reply_markup=get_main_menu(is_admin=is_admin_user))
+        await broadcast_jobs.start_job(bot, message.text, report_chat_id=message.chat.id, title="Розсилку надіслано.")
 
-    @dp.message(lambda m: m.text == "🔁 Тижнева розсилка")
-    async def weekly_broadcast(message: Message):
-        if not is_admin(message):
+    @text_router.route(keyboards.BTN_WEEKLY_BROADCAST)
+    async def weekly_broadcast(message: Message, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
-        text = db.get_weekly_broadcast() or "Текст тижневої розсилки ще не задано."
-        kb = ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="✅ Надіслати тижневу розсилку")], [KeyboardButton(text="‹ Повернутись до меню")]],
-            resize_keyboard=True
-        )
+        text = await async_db.get_weekly_broadcast() or "Текст тижневої розсилки ще не задано."
+        kb = keyboards.WEEKLY_SEND
         await message.answer(f"Поточний текст тижневої розсилки:\n\n{text}", reply_markup=kb)
 
-    @dp.message(lambda m: m.text == "✅ Надіслати тижневу розсилку")
-    async def send_weekly_broadcast(message: Message):
-        if not is_admin(message):
+    @text_router.route(keyboards.BTN_SEND_WEEKLY)
+    async def send_weekly_broadcast(message: Message, bot: Bot, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
-        text = db.get_weekly_broadcast()
+        text = await async_db.get_weekly_broadcast()
         if not text:
             return await message.answer("Текст тижневої розсилки не задано.")
-        users = db.get_all_users()
-        sent = 0
-        failed = 0
-        for user in users:
-            try:
-                await bot.send_message(user[0], text)
-                sent += 1
-            except Exception:
-                failed += 1
-        await message.answer(f"Тижнева розсилка надіслана. Успішно: {sent}, помилок: {failed}.", reply_markup=get_main_menu(is_admin=is_admin(message)))
-
-    @dp.message(lambda m: m.text == "✏️ Редагувати текст тижневої розсилки")
-    async def edit_weekly_broadcast(message: Message, state: FSMContext):
-        if not is_admin(message):
+        await message.answer("📨 Тижневу розсилку розпочато. Звіт надійде після завершення.", reply_markup=get_main_menu(is_admin=is_admin_user))
+        await broadcast_jobs.start_job(bot, text, report_chat_id=message.chat.id, title="Тижнева розсилка надіслана.")
+
+    @text_router.route(keyboards.BTN_EDIT_WEEKLY_TEXT)
+    async def edit_weekly_broadcast(message: Message, state: FSMContext, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
         await message.answer("Введіть новий текст для тижневої розсилки:")
         await state.set_state(AdminStates.waiting_for_weekly_text)
 
     @dp.message(AdminStates.waiting_for_weekly_text)
-    async def save_weekly_broadcast(message: Message, state: FSMContext):
-        db.set_weekly_broadcast(message.text)
-        await message.answer("Текст тижневої розсилки збережено!", reply_markup=get_main_menu(is_admin=is_admin(message)))
+    async def save_weekly_broadcast(message: Message, state: FSMContext, is_admin_user: bool = False):
+        await async_db.set_weekly_broadcast(message.text)
+        await message.answer("Текст тижневої розсилки збережено!", reply_markup=get_main_menu(is_admin=is_admin_user))
         await state.clear()
         
     # --- Редагування акцій ---
-    @dp.message(lambda m: m.text == "📝 Редагувати акції")
-    async def promo_action_menu(message: Message, state: FSMContext):
-        if not is_admin(message):
+    @text_router.route(keyboards.BTN_EDIT_PROMOS)
+    async def promo_action_menu(message: Message, state: FSMContext, is_admin_user: bool = False):
+        if not is_admin_user:
             return await message.answer("⛔️ Доступ заборонено.")
-        kb = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="➕ Додати акцію")],
-                [KeyboardButton(text="✏️ Редагувати акцію")],
-                [KeyboardButton(text="❌ Видалити акцію")],
-                [KeyboardButton(text="‹ Повернутись до меню")],
-            ], resize_keyboard=True
-        )
+        kb = keyboards.PROMO_ACTIONS
         await message.answer("Оберіть дію з акціями:", reply_markup=kb)
         await state.set_state(AdminStates.waiting_for_promo_action)
 
     @dp.message(AdminStates.waiting_for_promo_action)
-    async def handle_promo_action(message: Message, state: FSMContext):
+    async def handle_promo_action(message: Message, state: FSMContext, is_admin_user: bool = False):
         if message.text == "➕ Додати акцію":
             await message.answer("Введіть текст нової акції:")
             await state.set_state(AdminStates.waiting_for_new_promo)
         elif message.text == "✏️ Редагувати акцію":
-            promos = db.get_promos()
+            promos = await async_db.get_promos()
             if not promos:
-                await message.answer("Немає акцій для редагування.", reply_markup=get_main_menu(is_admin=is_admin(message)))
+                await message.answer("Немає акцій для редагування.", reply_markup=get_main_menu(is_admin=is_admin_user))
                 await state.clear()
                 return
             text = "Введіть номер акції для редагування:\n"
@@ -170,9 +198,9 @@ def register_broadcast_handlers(dp, bot, get_main_menu):
             await message.answer(text)
             await state.set_state(AdminStates.waiting_for_edit_promo_id)
         elif message.text == "❌ Видалити акцію":
-            promos = db.get_promos()
+            promos = await async_db.get_promos()
             if not promos:
-                await message.answer("Немає акцій для видалення.", reply_markup=get_main_menu(is_admin=is_admin(message)))
+                await message.answer("Немає акцій для видалення.", reply_markup=get_main_menu(is_admin=is_admin_user))
                 await state.clear()
                 return
             text = "Введіть номер акції для видалення:\n"
@@ -181,15 +209,15 @@ def register_broadcast_handlers(dp, bot, get_main_menu):
             await message.answer(text)
             await state.set_state(AdminStates.waiting_for_delete_promo_id)
         elif message.text == "‹ Повернутись до меню":
-            await message.answer("Повернення до меню.", reply_markup=get_main_menu(is_admin=is_admin(message)))
+            await message.answer("Повернення до меню.", reply_markup=get_main_menu(is_admin=is_admin_user))
             await state.clear()
         else:
             await message.answer("Оберіть дію з меню.")
 
     @dp.message(AdminStates.waiting_for_new_promo)
-    async def add_new_promo(message: Message, state: FSMContext):
-        db.add_promo(message.text)
-        await message.answer("Акцію додано!", reply_markup=get_main_menu(is_admin=is_admin(message)))
+    async def add_new_promo(message: Message, state: FSMContext, is_admin_user: bool = False):
+        await async_db.add_promo(message.text)
+        await message.answer("Акцію додано!", reply_markup=get_main_menu(is_admin=is_admin_user))
         await state.clear()
 
     @dp.message(AdminStates.waiting_for_edit_promo_id)
@@ -199,7 +227,7 @@ def register_broadcast_handlers(dp, bot, get_main_menu):
         except Exception:
             await message.answer("Введіть коректний номер акції!")
             return
-        promos = db.get_promos()
+        promos = await async_db.get_promos()
         if not any(pid == promo_id for pid, _ in promos):
             await message.answer("Акції з таким номером не існує!")
             return
@@ -208,44 +236,48 @@ def register_broadcast_handlers(dp, bot, get_main_menu):
         await state.set_state(AdminStates.waiting_for_edit_promo_text)
 
     @dp.message(AdminStates.waiting_for_edit_promo_text)
-    async def save_edited_promo(message: Message, state: FSMContext):
+    async def save_edited_promo(message: Message, state: FSMContext, is_admin_user: bool = False):
         data = await state.get_data()
         promo_id = data.get("edit_promo_id")
-        db.update_promo(promo_id, message.text)
-        await message.answer("Акцію оновлено!", reply_markup=get_main_menu(is_admin=is_admin(message)))
+        await async_db.update_promo(promo_id, message.text)
+        await message.answer("Акцію оновлено!", reply_markup=get_main_menu(is_admin=is_admin_user))
         await state.clear()
 
     @dp.message(AdminStates.waiting_for_delete_promo_id)
-    async def delete_promo_handler(message: Message, state: FSMContext):
+    async def delete_promo_handler(message: Message, state: FSMContext, is_admin_user: bool = False):
         try:
             promo_id = int(message.text.strip())
         except Exception:
             await message.answer("Введіть коректний номер акції!")
             return
-        promos = db.get_promos()
+        promos = await async_db.get_promos()
         if not any(pid == promo_id for pid, _ in promos):
             await message.answer("Акції з таким номером не існує!")
             return
-        db.delete_promo(promo_id)
-        await message.answer("Акцію видалено!", reply_markup=get_main_menu(is_admin=is_admin(message)))
+        await async_db.delete_promo(promo_id)
+        await message.answer("Акцію видалено!", reply_markup=get_main_menu(is_admin=is_admin_user))
         await state.clear()
 
 # --- Автоматична тижнева розсилка ---
+_scheduled_tasks = set()
+WEEKLY_LEASE_TTL = 3600  # довше за розбіжність годинників реплік, коротше за тиждень
+
 async def scheduled_weekly_broadcast(bot):
-    text = db.get_weekly_broadcast()
+    # Планувальник є в кожній репліці; розсилку створює та, що перша взяла оренду
+    if not await leases.try_acquire("weekly_broadcast", ttl=WEEKLY_LEASE_TTL):
+        return
+    text = await async_db.get_weekly_broadcast()
     if not text:
         return
-    users = db.get_all_users()
-    for user in users:
-        try:
-            await bot.send_message(user[0], text)
-        except Exception:
-            pass
+    # Розсилка йде фоновою задачею broadcast_jobs, тож зупиняється разом з процесом і звільняє оренду
+    await broadcast_jobs.start_job(bot, text)
 
 def start_scheduler(bot):
     scheduler = AsyncIOScheduler()
     def job_wrapper():
-        asyncio.create_task(scheduled_weekly_broadcast(bot))
+        task = asyncio.create_task(scheduled_weekly_broadcast(bot))
+        _scheduled_tasks.add(task)
+        task.add_done_callback(_scheduled_tasks.discard)
     day, hour, minute = db.get_weekly_time()
     scheduler.add_job(job_wrapper, "cron", day_of_week=day, hour=hour, minute=minute)
     scheduler.start()
@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+import logging
+import inspect
+from dataclasses import dataclass
+from typing import AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ліміти Telegram: ~30 повідомлень/с глобально, ~1 повідомлення/с в один чат
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+PER_CHAT_INTERVAL = 1.0
+MAX_RETRY_AFTER = 5  # скільки разів повторювати відправку після RetryAfter
+
+ResultCallback = Callable[[int, bool, Optional[str]], Union[Awaitable[None], None]]
+
+
+class TokenBucket:
+    """Token bucket rate limiter that can be paused (e.g. on RetryAfter)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` and drop accumulated burst"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._updated = self._paused_until
+        self._tokens = 0.0
+
+    async def acquire(self):
+        # Сон під замком: pause(), викликаний під час сну, врахується лише після пробудження
+        # (не більше ніж на 1/rate с пізніше) - черговість токенів важливіша
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Keeps at least `interval` seconds between messages to the same chat"""
+
+    def __init__(self, interval: float = PER_CHAT_INTERVAL):
+        self.interval = interval
+        self._next: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        if len(self._next) > 10000:
+            self._next = {k: v for k, v in self._next.items() if v > now}
+        ready_at = self._next.get(chat_id, 0.0)
+        self._next[chat_id] = max(now, ready_at) + self.interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+
+# Спільні для всіх розсилок процесу, щоб паралельні розсилки разом не перевищили ліміт
+_global_bucket = TokenBucket(BROADCAST_RATE)
+_chat_limiter = PerChatLimiter()
+
+
+@dataclass
+class BroadcastReport:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def rate(self) -> float:
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Успішно: {self.sent}, помилок: {self.failed}. "
+            f"Час: {self.elapsed:.1f} с ({self.rate:.1f} повідомлень/с)"
+        )
+
+
+class BroadcastEngine:
+    """Sends one text to many chats with bounded concurrency and rate limits"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        bucket: Optional[TokenBucket] = None,
+        chat_limiter: Optional[PerChatLimiter] = None,
+        progress_interval: float = 30.0,
+    ):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.bucket = bucket or _global_bucket
+        self.chat_limiter = chat_limiter or _chat_limiter
+        self.progress_interval = progress_interval
+
+    async def _send_one(self, chat_id: int, text: str, report: BroadcastReport) -> Optional[str]:
+        """Returns None on success or error description"""
+        for _ in range(MAX_RETRY_AFTER + 1):
+            # Спершу пауза для чату, потім токен: інакше токен згорає, поки чекаємо на чат
+            await self.chat_limiter.wait(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                return None
+            except TelegramRetryAfter as e:
+                logger.warning(f"⏸ RetryAfter {e.retry_after}s, розсилку призупинено")
+                self.bucket.pause(e.retry_after)
+                report.retries += 1
+                metrics.broadcast_retries.inc()
+            except Exception as e:
+                return str(e)
+        return "RetryAfter limit exceeded"
+
+    async def run(
+        self,
+        chat_ids: Union[Iterable[int], AsyncIterable[int]],
+        text: str,
+        on_result: Optional[ResultCallback] = None,
+    ) -> BroadcastReport:
+        report = BroadcastReport()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        started = time.monotonic()
+        last_progress = started
+
+        async def worker():
+            nonlocal last_progress
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    error = await self._send_one(chat_id, text, report)
+                    if error is None:
+                        report.sent += 1
+                        metrics.broadcast_messages.inc("sent")
+                    else:
+                        report.failed += 1
+                        metrics.broadcast_messages.inc("failed")
+                    if on_result is not None:
+                        res = on_result(chat_id, error is None, error)
+                        if inspect.isawaitable(res):
+                            await res
+                    now = time.monotonic()
+                    if now - last_progress >= self.progress_interval:
+                        last_progress = now
+                        report.elapsed = now - started
+                        logger.info(f"📨 Розсилка: {report.summary()}")
+                except Exception as e:
+                    logger.error(f"❌ Помилка в воркері розсилки: {e}", exc_info=True)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(chat_ids, "__aiter__"):
+                async for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+
+        report.elapsed = time.monotonic() - started
+        if report.total:
+            metrics.broadcast_rate.set(report.rate)
+        logger.info(f"✅ Розсилку завершено. {report.summary()}")
+        return report
@@ -0,0 +1,185 @@
+import os
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+import async_db
+import leases
+from broadcast_engine import BroadcastEngine, BroadcastReport
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500  # скільки отримувачів читаємо з БД за раз
+FLUSH_EVERY = 50  # як часто зберігаємо статуси доставки
+# Як часто підхоплювати перервані розсилки (хвилин): і свої, чию оренду ще тримав попередній процес,
+# і розсилки інстансу, що впав
+JOB_RESUME_INTERVAL = float(os.getenv("JOB_RESUME_INTERVAL", "5"))
+
+_job_tasks = set()
+_resume_task: Optional[asyncio.Task] = None
+
+
+async def run_job(bot, job_id: int, text: str, last_user_id: int = 0) -> BroadcastReport:
+    """
+    Send broadcast job to all users with user_id > last_user_id.
+
+    Recipients are read from the DB in batches; every delivery is recorded in
+    broadcast_deliveries so a restarted job skips users who already got it.
+    The checkpoint never moves past deliveries that are not recorded yet.
+    """
+    engine = BroadcastEngine(bot)
+    total = BroadcastReport()
+    pending: List[Tuple[int, str, Optional[str]]] = []
+    flush_lock = asyncio.Lock()
+
+    async def flush(checkpoint: Optional[int] = None):
+        # Записані статуси прибираємо лише після успішного запису; якщо запис упав,
+        # вони лишаються в pending і підуть у наступний flush разом з чекпоінтом
+        async with flush_lock:
+            batch = pending[:]
+            if batch or checkpoint is not None:
+                await async_db.record_broadcast_deliveries(job_id, batch, checkpoint)
+            del pending[:len(batch)]
+
+    async def on_result(chat_id: int, ok: bool, error: Optional[str]):
+        pending.append((chat_id, "sent" if ok else "failed", error))
+        if len(pending) >= FLUSH_EVERY and not flush_lock.locked():
+            try:
+                await flush()
+            except Exception as e:
+                logger.warning(f"⚠️ Розсилка {job_id}: статуси доставки не збережено, повтор пізніше: {e}")
+
+    try:
+        while True:
+            page = await async_db.get_users_page(last_user_id, BATCH_SIZE, ("user_id",))
+            if not page:
+                break
+            user_ids = [row[0] for row in page]
+            delivered = set(await async_db.get_delivered_user_ids(job_id, user_ids[0], user_ids[-1]))
+            recipients = [user_id for user_id in user_ids if user_id not in delivered]
+
+            report = await engine.run(recipients, text, on_result=on_result)
+            last_user_id = user_ids[-1]
+            # Чекпоінт пишеться в одній транзакції з усіма ще не збереженими статусами;
+            # якщо запис не вдався, розсилка переривається і продовжиться з попереднього чекпоінта
+            await flush(checkpoint=last_user_id)
+
+            total.sent += report.sent
+            total.failed += report.failed
+            total.retries += report.retries
+            total.elapsed += report.elapsed
+    except asyncio.CancelledError:
+        # Зупинка процесу: зберігаємо вже надіслане, щоб після відновлення ці гості не отримали повтор
+        try:
+            await flush()
+        except Exception as e:
+            logger.error(f"❌ Розсилка {job_id}: статуси доставки не збережено при зупинці: {e}")
+        raise
+
+    await async_db.finish_broadcast_job(job_id)
+    return total
+
+
+def _lease_name(job_id: int) -> str:
+    return f"broadcast_job:{job_id}"
+
+
+async def run_job_with_report(bot, job_id: int, text: str, last_user_id: Optional[int] = 0,
+                              report_chat_id: Optional[int] = None, title: str = "Розсилку надіслано."):
+    """Run job under its lease and send report; last_user_id=None - continue from checkpoint in DB"""
+    # Оренда гарантує, що розсилку веде лише один інстанс
+    try:
+        async with leases.hold(_lease_name(job_id)) as acquired:
+            if not acquired:
+                logger.info(f"Розсилка {job_id} вже виконується іншим інстансом")
+                return None
+            if last_user_id is None:
+                # Поки ми чекали, розсилку міг вести (і завершити) інший інстанс
+                checkpoints = {row[0]: row[2] for row in await async_db.get_unfinished_broadcast_jobs()}
+                if job_id not in checkpoints:
+                    return None
+                last_user_id = checkpoints[job_id]
+            try:
+                report = await run_job(bot, job_id, text, last_user_id)
+            except Exception as e:
+                logger.error(f"❌ Розсилка {job_id} перервана: {e}", exc_info=True)
+                return None
+    except leases.LeaseLost:
+        # Розсилку продовжить з чекпоінта інстанс, який візьме оренду
+        logger.warning(f"⚠️ Розсилку {job_id} зупинено: оренду втрачено")
+        return None
+    if report_chat_id is not None:
+        sent, failed = await async_db.get_broadcast_job_stats(job_id)
+        report.sent, report.failed = sent, failed
+        try:
+            await bot.send_message(report_chat_id, f"{title} {report.summary()}")
+        except Exception as e:
+            logger.error(f"❌ Не вдалося надіслати звіт розсилки: {e}")
+    return report
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return task
+
+
+async def start_job(bot, text: str, report_chat_id: Optional[int] = None, title: str = "Розсилку надіслано."):
+    """Persist new broadcast job and run it in background"""
+    job_id = await async_db.create_broadcast_job(text, report_chat_id)
+    if job_id is None:
+        raise RuntimeError("Не вдалося створити розсилку")
+    return _spawn(run_job_with_report(bot, job_id, text, 0, report_chat_id, title))
+
+
+async def resume_unfinished_jobs(bot):
+    """
+    Continue jobs interrupted by restart (call on startup; start_resume_loop repeats it).
+
+    Jobs still running elsewhere are skipped by their lease; the checkpoint is re-read
+    after the lease is taken, so a job taken over from a dead instance continues where it stopped.
+    """
+    jobs = await async_db.get_unfinished_broadcast_jobs()
+    jobs = [job for job in jobs if not leases.is_held(_lease_name(job[0]))]
+    for job_id, text, last_user_id, report_chat_id in jobs:
+        logger.info(f"🔁 Відновлення розсилки {job_id} з user_id > {last_user_id}")
+        _spawn(run_job_with_report(bot, job_id, text, None, report_chat_id,
+                                   title="Розсилку (відновлену після перезапуску) надіслано."))
+    return len(jobs)
+
+
+async def _resume_loop(bot):
+    while True:
+        await asyncio.sleep(JOB_RESUME_INTERVAL * 60)
+        try:
+            await resume_unfinished_jobs(bot)
+        except Exception as e:
+            logger.error(f"❌ Помилка відновлення розсилок: {e}", exc_info=True)
+
+
+def start_resume_loop(bot):
+    """
+    Periodically resume unfinished jobs. Also needed with one instance: after a crash the
+    previous process's lease stays live for LEASE_TTL, so the resume on startup skips the job
+    """
+    global _resume_task
+    if _resume_task is None or _resume_task.done():
+        _resume_task = asyncio.create_task(_resume_loop(bot))
+
+
+async def shutdown():
+    """
+    Stop running jobs and release their leases (call on shutdown, before async_db.shutdown()).
+    Checkpoints stay in the DB, so the next process resumes the jobs right on startup
+    """
+    global _resume_task
+    if _resume_task is not None:
+        _resume_task.cancel()
+        _resume_task = None
+    tasks = list(_job_tasks)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"⏹ Зупинено розсилок: {len(tasks)}")
@@ -0,0 +1,71 @@
+import time
+import weakref
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+
+_MISSING = object()
+
+# Усі кеші процесу (для метрик hit ratio)
+_instances: "weakref.WeakSet[LRUCache]" = weakref.WeakSet()
+
+
+def all_caches() -> List["LRUCache"]:
+    return sorted(_instances, key=lambda cache: cache.name)
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with optional TTL.
+
+    Used from DB executor threads, so every operation takes a lock.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self, key: Hashable, default: Any = None, count_miss: bool = True) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            if count_miss:
+                self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate: Callable[[Hashable, Any], bool]):
+        """Remove entries for which predicate(key, value) is true"""
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -21,6 +21,13 @@ else:
 
 # Admin usernames (можна вказати через кому в змінній оточення або використати дефолтне значення)
 ADMIN_USERNAMES_STR = os.getenv("ADMIN_USERNAMES", "Andruh_a")
-ADMIN_USERNAMES = [username.strip() for username in ADMIN_USERNAMES_STR.split(",")]
-logger.info(f"Admin usernames: {ADMIN_USERNAMES}")
+ADMIN_USERNAMES = frozenset(username.strip() for username in ADMIN_USERNAMES_STR.split(",") if username.strip())
+logger.info(f"Admin usernames: {sorted(ADMIN_USERNAMES)}")
+
+# Telegram user ID адмінів (через кому) - додаються в таблицю admins при старті.
+# ID не змінюється, на відміну від username, тому це надійніший спосіб.
+ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "")
+ADMIN_IDS = frozenset(int(user_id) for user_id in ADMIN_IDS_STR.split(",") if user_id.strip())
+if ADMIN_IDS:
+    logger.info(f"Admin IDs: {sorted(ADMIN_IDS)}")
 
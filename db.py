@@ -1,7 +1,14 @@
+import io
 import os
+import csv
 import logging
-from typing import List, Tuple, Optional
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 import threading
+import time
+
+from cache import LRUCache
+from db_pool import ConnectionPool
 
 logger = logging.getLogger(__name__)
 
@@ -26,515 +33,1544 @@ else:
     USE_POSTGRES = False
     logger.info("Using SQLite database")
 
-# Thread-local storage for connections
-_local = threading.local()
+# Connection pool settings
+SQLITE_PATH = os.getenv("SQLITE_PATH", "loyalty.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def _connect_sqlite():
+    """Open SQLite connection with WAL mode and tuned pragmas"""
+    conn = sqlite3.connect(SQLITE_PATH, timeout=DB_POOL_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-8000")  # ~8MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def _connect_postgres():
+    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+
+def _ping(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT 1")
+    cur.fetchone()
+    conn.rollback()
 
-def get_connection():
-    """Get database connection (thread-safe)"""
-    global USE_POSTGRES
+def _sqlite_pool() -> ConnectionPool:
+    return ConnectionPool(
+        _connect_sqlite,
+        size=DB_POOL_SIZE,
+        health_check=_ping,
+        timeout=DB_POOL_TIMEOUT,
+        disconnect_errors=(sqlite3.ProgrammingError,),
+        name="sqlite",
+    )
+
+def get_pool() -> ConnectionPool:
+    """Get connection pool (created on first use)"""
+    global _pool, USE_POSTGRES
     
-    if not hasattr(_local, 'connection') or _local.connection is None:
-        if USE_POSTGRES and DATABASE_URL:
-            try:
-                _local.connection = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-                logger.info("Connected to PostgreSQL successfully")
-            except Exception as e:
-                logger.error(f"Failed to connect to PostgreSQL: {e}")
-                logger.info("Falling back to SQLite")
-                USE_POSTGRES = False
-                _local.connection = sqlite3.connect("loyalty.db")
-        else:
-            _local.connection = sqlite3.connect("loyalty.db")
-    return _local.connection
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if USE_POSTGRES and DATABASE_URL:
+                    pool = ConnectionPool(
+                        _connect_postgres,
+                        size=DB_POOL_SIZE,
+                        health_check=_ping,
+                        timeout=DB_POOL_TIMEOUT,
+                        disconnect_errors=(psycopg2.OperationalError, psycopg2.InterfaceError),
+                        name="postgres",
+                    )
+                    try:
+                        pool.release(pool.acquire())
+                        logger.info("Connected to PostgreSQL successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to connect to PostgreSQL: {e}")
+                        logger.info("Falling back to SQLite")
+                        USE_POSTGRES = False
+                        pool = _sqlite_pool()
+                else:
+                    pool = _sqlite_pool()
+                _pool = pool
+    return _pool
 
-def close_connection():
-    """Close database connection"""
-    if hasattr(_local, 'connection') and _local.connection:
-        _local.connection.close()
-        _local.connection = None
+def connection():
+    """Check out pooled connection: `with connection() as conn: ...`"""
+    return get_pool().connection()
+
+def close_pool():
+    """Close all idle pooled connections"""
+    if _pool is not None:
+        _pool.close_all()
 
 def init_db():
     """Initialize database tables"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        if USE_POSTGRES:
-            # PostgreSQL syntax
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    phone VARCHAR(20),
-                    bonus_points INTEGER DEFAULT 0,
-                    total_spent INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            # Add total_spent column if it doesn't exist
-            try:
-                cur.execute("ALTER TABLE users ADD COLUMN total_spent INTEGER DEFAULT 0")
-                conn.commit()
-            except Exception:
-                pass  # Column already exists
-        else:
-            # SQLite syntax
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    phone TEXT,
-                    bonus_points INTEGER DEFAULT 0,
-                    total_spent INTEGER DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            # Add total_spent column if it doesn't exist
-            try:
-                cur.execute("ALTER TABLE users ADD COLUMN total_spent INTEGER DEFAULT 0")
-                conn.commit()
-            except Exception:
-                pass  # Column already exists
+        with connection() as conn:
+            cur = conn.cursor()
         
-        conn.commit()
-        logger.info("Users table initialized successfully")
+            if USE_POSTGRES:
+                # PostgreSQL syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        user_id BIGINT PRIMARY KEY,
+                        phone VARCHAR(20),
+                        bonus_points INTEGER DEFAULT 0,
+                        total_spent INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            else:
+                # SQLite syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        user_id INTEGER PRIMARY KEY,
+                        phone TEXT,
+                        bonus_points INTEGER DEFAULT 0,
+                        total_spent INTEGER DEFAULT 0,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            
+            _migrate_users(conn, cur)
+            conn.commit()
+            logger.info("Users table initialized successfully")
         
     except Exception as e:
         logger.error(f"Error initializing users table: {e}")
-    finally:
-        if not USE_POSTGRES:  # SQLite connections should be closed
-            close_connection()
+
+def _migrate_users(conn, cur):
+    """Add columns introduced after the users table was created, backfill them and build indexes"""
+    if USE_POSTGRES:
+        # Add total_spent column if it doesn't exist
+        cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS total_spent INTEGER DEFAULT 0")
+        cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_normalized VARCHAR(20)")
+    else:
+        # Add total_spent column if it doesn't exist
+        try:
+            cur.execute("ALTER TABLE users ADD COLUMN total_spent INTEGER DEFAULT 0")
+            conn.commit()
+        except Exception:
+            pass  # Column already exists
+        # Add phone_normalized column if it doesn't exist
+        try:
+            cur.execute("ALTER TABLE users ADD COLUMN phone_normalized TEXT")
+            conn.commit()
+        except Exception:
+            pass  # Column already exists
+    
+    _backfill_phone_normalized(cur)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_phone_normalized ON users (phone_normalized)")
+
+def migrate_users_table():
+    """
+    Bring an existing users table up to date (idempotent). For deployments that skip init_db
+    because the table already exists: add_user and phone lookups need phone_normalized
+    """
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            _migrate_users(conn, cur)
+            conn.commit()
+            logger.info("Users table migrated successfully")
+        
+    except Exception as e:
+        logger.error(f"Error migrating users table: {e}")
+        raise
 
 def init_promos_table():
     """Initialize promos table"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            # PostgreSQL syntax
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS promos (
-                    id SERIAL PRIMARY KEY,
-                    text TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            # SQLite syntax
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS promos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    text TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+            if USE_POSTGRES:
+                # PostgreSQL syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS promos (
+                        id SERIAL PRIMARY KEY,
+                        text TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            else:
+                # SQLite syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS promos (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        text TEXT NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
         
-        conn.commit()
-        logger.info("Promos table initialized successfully")
+            conn.commit()
+            logger.info("Promos table initialized successfully")
         
     except Exception as e:
         logger.error(f"Error initializing promos table: {e}")
-    finally:
-        if not USE_POSTGRES:  # SQLite connections should be closed
-            close_connection()
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """
+    Normalize phone to digits with country code: '+38 (050) 111-22-33', '0501112233' -> '380501112233'.
+    Used for QR lookups, so the same guest is found however the number was written.
+    """
+    if not phone:
+        return None
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    if len(digits) == 10 and digits.startswith("0"):  # Ukrainian local format
+        digits = "38" + digits
+    return digits or None
+
+def _backfill_phone_normalized(cur):
+    """Fill phone_normalized for rows created before the column existed"""
+    cur.execute("SELECT user_id, phone FROM users WHERE phone_normalized IS NULL AND phone IS NOT NULL")
+    rows = cur.fetchall()
+    if not rows:
+        return
+    if USE_POSTGRES:
+        rows = [(row['user_id'], row['phone']) for row in rows]
+    cur.execute("SELECT phone_normalized FROM users WHERE phone_normalized IS NOT NULL")
+    taken = {row['phone_normalized'] if USE_POSTGRES else row[0] for row in cur.fetchall()}
+    
+    updates = []
+    for user_id, phone in rows:
+        normalized = normalize_phone(phone)
+        if normalized is None:
+            continue
+        if normalized in taken:
+            logger.warning(f"Phone of user {user_id} is already used by another user, skipping in phone index")
+            continue
+        taken.add(normalized)
+        updates.append((normalized, user_id))
+    
+    placeholder = "%s" if USE_POSTGRES else "?"
+    cur.executemany(f"UPDATE users SET phone_normalized = {placeholder} WHERE user_id = {placeholder}", updates)
+    logger.info(f"Normalized phones backfilled: {len(updates)}")
+
+# Cache of normalized phone -> user_id for repeated QR scans. Balances are never cached:
+# they change in other processes (staff scans, imports), so the row is always read fresh
+_phone_cache = LRUCache(maxsize=int(os.getenv("PHONE_CACHE_SIZE", "2048")), ttl=float(os.getenv("PHONE_CACHE_TTL", "300")), name="phone")
+
+def _forget_user(user_id: int):
+    """Drop cached phone lookups for user (after phone change)"""
+    _phone_cache.discard_if(lambda key, cached_user_id: cached_user_id == user_id)
 
 def add_user(user_id: int, phone: str, bonus_points: int = 0, total_spent: int = 0):
     """Add or update user"""
+    normalized = normalize_phone(phone)
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("""
-                INSERT INTO users (user_id, phone, bonus_points, total_spent) 
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (user_id) 
-                DO UPDATE SET phone = EXCLUDED.phone, bonus_points = EXCLUDED.bonus_points, total_spent = EXCLUDED.total_spent
-            """, (user_id, phone, bonus_points, total_spent))
-        else:
-            cur.execute("""
-                INSERT OR REPLACE INTO users (user_id, phone, bonus_points, total_spent) 
-                VALUES (?, ?, ?, ?)
-            """, (user_id, phone, bonus_points, total_spent))
+            if USE_POSTGRES:
+                # Phone moves to the new account if another user registered it before
+                cur.execute(
+                    "UPDATE users SET phone_normalized = NULL WHERE phone_normalized = %s AND user_id <> %s",
+                    (normalized, user_id)
+                )
+                cur.execute("""
+                    INSERT INTO users (user_id, phone, phone_normalized, bonus_points, total_spent) 
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (user_id) 
+                    DO UPDATE SET phone = EXCLUDED.phone, phone_normalized = EXCLUDED.phone_normalized,
+                        bonus_points = EXCLUDED.bonus_points, total_spent = EXCLUDED.total_spent
+                """, (user_id, phone, normalized, bonus_points, total_spent))
+            else:
+                # Phone moves to the new account if another user registered it before
+                cur.execute(
+                    "UPDATE users SET phone_normalized = NULL WHERE phone_normalized = ? AND user_id <> ?",
+                    (normalized, user_id)
+                )
+                cur.execute("""
+                    INSERT INTO users (user_id, phone, phone_normalized, bonus_points, total_spent) 
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET phone = excluded.phone, phone_normalized = excluded.phone_normalized,
+                        bonus_points = excluded.bonus_points, total_spent = excluded.total_spent
+                """, (user_id, phone, normalized, bonus_points, total_spent))
         
-        conn.commit()
-        logger.info(f"User {user_id} added/updated successfully")
+            conn.commit()
+            _phone_cache.pop(normalized)
+            _forget_user(user_id)
+            logger.info(f"User {user_id} added/updated successfully")
         
     except Exception as e:
         logger.error(f"Error adding user: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
-def get_user(user_id: int) -> Optional[Tuple[str, int, int]]:
-    """Get user by ID - returns (phone, bonus_points, total_spent)"""
+def get_user_by_phone(phone: str) -> Optional[Tuple[int, str, int, int]]:
+    """Find user by phone (e.g. scanned QR code) - returns (user_id, phone, bonus_points, total_spent)"""
+    normalized = normalize_phone(phone)
+    if normalized is None:
+        return None
+    cached_user_id = _phone_cache.get(normalized)
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        if USE_POSTGRES:
-            cur.execute("SELECT phone, bonus_points, total_spent FROM users WHERE user_id = %s", (user_id,))
-            row = cur.fetchone()
-            if row:
-                return (row['phone'], row['bonus_points'], row['total_spent'])
-        else:
-            cur.execute("SELECT phone, bonus_points, total_spent FROM users WHERE user_id = ?", (user_id,))
-            result = cur.fetchone()
-            if result:
-                return result
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                user = None
+                if cached_user_id is not None:
+                    # Lookup by primary key; phone check catches a phone moved to another user elsewhere
+                    cur.execute("""
+                        SELECT user_id, phone, bonus_points, total_spent FROM users
+                        WHERE user_id = %s AND phone_normalized = %s
+                    """, (cached_user_id, normalized))
+                    user = cur.fetchone()
+                if not user:
+                    cur.execute("""
+                        SELECT user_id, phone, bonus_points, total_spent FROM users
+                        WHERE phone_normalized = %s
+                    """, (normalized,))
+                    user = cur.fetchone()
+                user = (user['user_id'], user['phone'], user['bonus_points'], user['total_spent']) if user else None
+            else:
+                user = None
+                if cached_user_id is not None:
+                    # Lookup by primary key; phone check catches a phone moved to another user elsewhere
+                    cur.execute("""
+                        SELECT user_id, phone, bonus_points, total_spent FROM users
+                        WHERE user_id = ? AND phone_normalized = ?
+                    """, (cached_user_id, normalized))
+                    user = cur.fetchone()
+                if not user:
+                    cur.execute("""
+                        SELECT user_id, phone, bonus_points, total_spent FROM users
+                        WHERE phone_normalized = ?
+                    """, (normalized,))
+                    user = cur.fetchone()
             
+            if user:
+                _phone_cache.set(normalized, user[0])
+            elif cached_user_id is not None:
+                _phone_cache.pop(normalized)
+            return user
+        
+    except Exception as e:
+        logger.error(f"Error getting user by phone: {e}")
         return None
+
+def _fetch_user(cur, user_id: int) -> Optional[Tuple[str, int, int]]:
+    """Read (phone, bonus_points, total_spent) using an open cursor"""
+    if USE_POSTGRES:
+        cur.execute("SELECT phone, bonus_points, total_spent FROM users WHERE user_id = %s", (user_id,))
+        row = cur.fetchone()
+        if row:
+            return (row['phone'], row['bonus_points'], row['total_spent'])
+    else:
+        cur.execute("SELECT phone, bonus_points, total_spent FROM users WHERE user_id = ?", (user_id,))
+        result = cur.fetchone()
+        if result:
+            return result
+    return None
+
+def get_user(user_id: int) -> Optional[Tuple[str, int, int]]:
+    """Get user by ID - returns (phone, bonus_points, total_spent)"""
+    try:
+        with connection() as conn:
+            return _fetch_user(conn.cursor(), user_id)
         
     except Exception as e:
         logger.error(f"Error getting user: {e}")
         return None
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
-def get_all_users() -> List[Tuple[int, str, int, int]]:
-    """Get all users - returns (user_id, phone, bonus_points, total_spent)"""
+# Columns that callers may select from users table
+USER_COLUMNS = ("user_id", "phone", "bonus_points", "total_spent", "created_at")
+
+def get_users_page(after_user_id: int = 0, limit: int = 500, columns: Sequence[str] = ("user_id",)) -> List[tuple]:
+    """
+    Get next page of users ordered by user_id (keyset pagination).
+    Returns tuples with requested columns.
+    """
+    unknown = [c for c in columns if c not in USER_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown user columns: {unknown}")
+    # user_id is always selected: it is the keyset cursor
+    select = ["user_id"] + [c for c in columns if c != "user_id"]
+    
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            # Звичайний курсор: сторінка обмежена LIMIT, іменований курсор дав би лише зайвий round trip
+            cur = conn.cursor()
+            if USE_POSTGRES:
+                cur.execute(
+                    f"SELECT {', '.join(select)} FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                    (after_user_id, limit)
+                )
+            else:
+                cur.execute(
+                    f"SELECT {', '.join(select)} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (after_user_id, limit)
+                )
         
-        if USE_POSTGRES:
-            cur.execute("SELECT user_id, phone, bonus_points, total_spent FROM users ORDER BY created_at")
-            rows = cur.fetchall()
-            return [(row['user_id'], row['phone'], row['bonus_points'], row['total_spent']) for row in rows]
-        else:
-            cur.execute("SELECT user_id, phone, bonus_points, total_spent FROM users ORDER BY created_at")
-            return cur.fetchall()
+            rows = []
+            for row in cur.fetchall():
+                values = tuple(row[c] for c in select) if USE_POSTGRES else tuple(row)
+                rows.append(tuple(values[select.index(c)] for c in columns))
+            cur.close()
+            return rows
+        
+    except Exception as e:
+        logger.error(f"Error getting users page: {e}")
+        raise
+
+def get_users_batch(columns: Sequence[str] = ("user_id",), batch_size: int = 500, after_user_id: int = 0) -> Tuple[List[tuple], Optional[int]]:
+    """
+    One step of iter_users - returns (rows with requested columns, after_user_id for the next step).
+    The next cursor is None when there are no more users.
+    """
+    select = tuple(columns) if "user_id" in columns else ("user_id",) + tuple(columns)
+    page = get_users_page(after_user_id, batch_size, select)
+    if not page:
+        return [], None
+    rows = page if "user_id" in columns else [row[1:] for row in page]
+    next_after = page[-1][select.index("user_id")] if len(page) == batch_size else None
+    return rows, next_after
+
+def iter_users(columns: Sequence[str] = ("user_id",), batch_size: int = 500, after_user_id: int = 0) -> Iterator[tuple]:
+    """
+    Iterate over users ordered by user_id without loading the whole table.
+    Each page is read on its own pooled connection, so slow consumers don't hold it.
+    """
+    while after_user_id is not None:
+        rows, after_user_id = get_users_batch(columns, batch_size, after_user_id)
+        yield from rows
+
+def get_all_users() -> List[Tuple[int, str, int, int]]:
+    """Get all users - returns (user_id, phone, bonus_points, total_spent). Prefer iter_users for large tables"""
+    try:
+        return list(iter_users(("user_id", "phone", "bonus_points", "total_spent")))
             
     except Exception as e:
         logger.error(f"Error getting all users: {e}")
         return []
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
+
+def _prepare_import_rows(rows: Iterable[Tuple[int, str, Optional[int], Optional[int]]]) -> List[Tuple[int, str, Optional[str], Optional[int], Optional[int]]]:
+    """
+    Deduplicate a batch: last row of a user_id wins, and a phone shared by several
+    users of the batch stays indexed for the last of them (as in add_user)
+    """
+    by_user = {}
+    for user_id, phone, bonus_points, total_spent in rows:
+        by_user.pop(user_id, None)  # щоб порядок відповідав останньому входженню
+        by_user[user_id] = (phone, normalize_phone(phone), bonus_points, total_spent)
+    owner = {normalized: user_id for user_id, (_, normalized, _, _) in by_user.items() if normalized}
+    return [
+        (user_id, phone, normalized if owner.get(normalized) == user_id else None, bonus_points, total_spent)
+        for user_id, (phone, normalized, bonus_points, total_spent) in by_user.items()
+    ]
+
+def bulk_upsert_users(rows: Iterable[Tuple[int, str, Optional[int], Optional[int]]]) -> int:
+    """
+    Insert or update a batch of (user_id, phone, bonus_points, total_spent) in one transaction.
+    bonus_points/total_spent None keeps the existing value (0 for new users), so a file
+    without these columns never resets balances.
+    PostgreSQL: COPY into a temp table + UPDATE ... FROM + INSERT; SQLite: executemany.
+    Returns number of rows written
+    """
+    batch = _prepare_import_rows(rows)
+    if not batch:
+        return 0
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+
+            if USE_POSTGRES:
+                cur.execute("""
+                    CREATE TEMP TABLE users_import (
+                        user_id BIGINT, phone VARCHAR(20), phone_normalized VARCHAR(20),
+                        bonus_points INTEGER, total_spent INTEGER
+                    ) ON COMMIT DROP
+                """)
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cur.copy_expert(
+                    "COPY users_import (user_id, phone, phone_normalized, bonus_points, total_spent) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+                # Phone moves to the imported account if another user had it
+                cur.execute("""
+                    UPDATE users SET phone_normalized = NULL FROM users_import i
+                    WHERE users.phone_normalized = i.phone_normalized AND users.user_id <> i.user_id
+                """)
+                cur.execute("""
+                    UPDATE users SET phone = i.phone, phone_normalized = i.phone_normalized,
+                        bonus_points = COALESCE(i.bonus_points, users.bonus_points),
+                        total_spent = COALESCE(i.total_spent, users.total_spent)
+                    FROM users_import i WHERE users.user_id = i.user_id
+                """)
+                cur.execute("""
+                    INSERT INTO users (user_id, phone, phone_normalized, bonus_points, total_spent)
+                    SELECT user_id, phone, phone_normalized, COALESCE(bonus_points, 0), COALESCE(total_spent, 0)
+                    FROM users_import
+                    ON CONFLICT (user_id) DO NOTHING
+                """)
+            else:
+                # Phone moves to the imported account if another user had it
+                cur.executemany(
+                    "UPDATE users SET phone_normalized = NULL WHERE phone_normalized = ? AND user_id <> ?",
+                    [(normalized, user_id) for user_id, _, normalized, _, _ in batch if normalized]
+                )
+                cur.executemany("""
+                    UPDATE users SET phone = ?, phone_normalized = ?,
+                        bonus_points = COALESCE(?, bonus_points), total_spent = COALESCE(?, total_spent)
+                    WHERE user_id = ?
+                """, [(phone, normalized, bonus_points, total_spent, user_id)
+                      for user_id, phone, normalized, bonus_points, total_spent in batch])
+                cur.executemany("""
+                    INSERT INTO users (user_id, phone, phone_normalized, bonus_points, total_spent)
+                    VALUES (?, ?, ?, COALESCE(?, 0), COALESCE(?, 0))
+                    ON CONFLICT (user_id) DO NOTHING
+                """, batch)
+
+            conn.commit()
+            _phone_cache.clear()
+            logger.info(f"Bulk users upserted: {len(batch)}")
+            return len(batch)
+
+    except Exception as e:
+        logger.error(f"Error importing users: {e}")
+        raise
+
+# Columns of users export (in this order)
+EXPORT_COLUMNS = ("user_id", "phone", "bonus_points", "total_spent", "created_at")
+
+def export_users_csv(out, batch_size: int = 5000) -> int:
+    """
+    Stream all users ordered by user_id to text file `out` as CSV with header.
+    PostgreSQL: COPY ... TO STDOUT; SQLite: keyset pages. Returns number of rows written
+    """
+    try:
+        if USE_POSTGRES:
+            with connection() as conn:
+                cur = conn.cursor()
+                # cur.rowcount після COPY TO у psycopg2 < 2.9 дорівнює -1, тому рахуємо окремим запитом;
+                # REPEATABLE READ - щоб COUNT і COPY бачили один знімок таблиці
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cur.execute("SELECT COUNT(*) AS count FROM users")
+                count = cur.fetchone()['count']
+                cur.copy_expert(
+                    f"COPY (SELECT {', '.join(EXPORT_COLUMNS)} FROM users ORDER BY user_id) TO STDOUT WITH (FORMAT csv, HEADER)",
+                    out
+                )
+                conn.commit()
+        else:
+            writer = csv.writer(out)
+            writer.writerow(EXPORT_COLUMNS)
+            count = 0
+            for row in iter_users(EXPORT_COLUMNS, batch_size):
+                writer.writerow(row)
+                count += 1
+        logger.info(f"Users exported: {count}")
+        return count
+
+    except Exception as e:
+        logger.error(f"Error exporting users: {e}")
+        raise
+
+# Read-through cache for rarely changed rows (promos, weekly broadcast settings).
+# Writes in this process invalidate it, TTL bounds staleness from other processes
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "300"))
+CACHE_MISS = object()
+_settings_cache = LRUCache(maxsize=16, ttl=SETTINGS_CACHE_TTL, name="settings")
+
+def set_cache_ttl(ttl: float):
+    """
+    Change TTL of settings and phone caches (e.g. with several worker processes or replicas,
+    where writes in another process never invalidate this process's copies). 0 disables them
+    """
+    for cache in (_settings_cache, _phone_cache):
+        cache.ttl = ttl
+        cache.clear()
+
+def get_cached(key: str):
+    """Peek into settings cache without touching DB - returns CACHE_MISS if not cached"""
+    return _settings_cache.get(key, CACHE_MISS, count_miss=False)
+
+def _invalidate_promos():
+    _settings_cache.pop("promos")
+    _settings_cache.pop("promos_html")
 
 def get_promos() -> List[Tuple[int, str]]:
     """Get all promos"""
+    cached = _settings_cache.get("promos", CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return cached
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("SELECT id, text FROM promos ORDER BY id")
-            rows = cur.fetchall()
-            return [(row['id'], row['text']) for row in rows]
-        else:
-            cur.execute("SELECT id, text FROM promos ORDER BY id")
-            return cur.fetchall()
+            if USE_POSTGRES:
+                cur.execute("SELECT id, text FROM promos ORDER BY id")
+                rows = cur.fetchall()
+                promos = [(row['id'], row['text']) for row in rows]
+            else:
+                cur.execute("SELECT id, text FROM promos ORDER BY id")
+                promos = cur.fetchall()
+        
+        _settings_cache.set("promos", promos)
+        return promos
             
     except Exception as e:
         logger.error(f"Error getting promos: {e}")
         return []
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
+
+def get_promos_html() -> Optional[str]:
+    """Get pre-rendered promo list for "🏷 Акції" (None if there are no promos)"""
+    cached = _settings_cache.get("promos_html", CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return cached
+    promos = get_promos()
+    html = None
+    if promos:
+        html = "<b>Актуальні акції:</b>\n"
+        for pid, promo in promos:
+            html += f"\n{pid}. {promo}"
+    _settings_cache.set("promos_html", html)
+    return html
 
 def add_promo(text: str):
     """Add promo"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("INSERT INTO promos (text) VALUES (%s)", (text,))
-        else:
-            cur.execute("INSERT INTO promos (text) VALUES (?)", (text,))
+            if USE_POSTGRES:
+                cur.execute("INSERT INTO promos (text) VALUES (%s)", (text,))
+            else:
+                cur.execute("INSERT INTO promos (text) VALUES (?)", (text,))
         
-        conn.commit()
-        logger.info("Promo added successfully")
+            conn.commit()
+            _invalidate_promos()
+            logger.info("Promo added successfully")
         
     except Exception as e:
         logger.error(f"Error adding promo: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def delete_promo(promo_id: int):
     """Delete promo"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("DELETE FROM promos WHERE id = %s", (promo_id,))
-        else:
-            cur.execute("DELETE FROM promos WHERE id = ?", (promo_id,))
+            if USE_POSTGRES:
+                cur.execute("DELETE FROM promos WHERE id = %s", (promo_id,))
+            else:
+                cur.execute("DELETE FROM promos WHERE id = ?", (promo_id,))
         
-        conn.commit()
-        logger.info(f"Promo {promo_id} deleted successfully")
+            conn.commit()
+            _invalidate_promos()
+            logger.info(f"Promo {promo_id} deleted successfully")
         
     except Exception as e:
         logger.error(f"Error deleting promo: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def clear_promos():
     """Clear all promos"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        cur.execute("DELETE FROM promos")
-        conn.commit()
-        logger.info("All promos cleared successfully")
+            cur.execute("DELETE FROM promos")
+            conn.commit()
+            _invalidate_promos()
+            logger.info("All promos cleared successfully")
         
     except Exception as e:
         logger.error(f"Error clearing promos: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def update_promo(promo_id: int, text: str):
     """Update promo text"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("UPDATE promos SET text = %s WHERE id = %s", (text, promo_id))
-        else:
-            cur.execute("UPDATE promos SET text = ? WHERE id = ?", (text, promo_id))
+            if USE_POSTGRES:
+                cur.execute("UPDATE promos SET text = %s WHERE id = %s", (text, promo_id))
+            else:
+                cur.execute("UPDATE promos SET text = ? WHERE id = ?", (text, promo_id))
         
-        conn.commit()
-        logger.info(f"Promo {promo_id} updated successfully")
+            conn.commit()
+            _invalidate_promos()
+            logger.info(f"Promo {promo_id} updated successfully")
         
     except Exception as e:
         logger.error(f"Error updating promo: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def init_weekly_broadcast_table():
     """Initialize weekly broadcast table"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            # PostgreSQL syntax
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS weekly_broadcast (
-                    id SERIAL PRIMARY KEY,
-                    text TEXT,
-                    day_of_week INTEGER DEFAULT 1,
-                    hour INTEGER DEFAULT 10,
-                    minute INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            # SQLite syntax
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS weekly_broadcast (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    text TEXT,
-                    day_of_week INTEGER DEFAULT 1,
-                    hour INTEGER DEFAULT 10,
-                    minute INTEGER DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+            if USE_POSTGRES:
+                # PostgreSQL syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS weekly_broadcast (
+                        id SERIAL PRIMARY KEY,
+                        text TEXT,
+                        day_of_week INTEGER DEFAULT 1,
+                        hour INTEGER DEFAULT 10,
+                        minute INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            else:
+                # SQLite syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS weekly_broadcast (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        text TEXT,
+                        day_of_week INTEGER DEFAULT 1,
+                        hour INTEGER DEFAULT 10,
+                        minute INTEGER DEFAULT 0,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
         
-        conn.commit()
-        logger.info("Weekly broadcast table initialized successfully")
+            conn.commit()
+            logger.info("Weekly broadcast table initialized successfully")
         
     except Exception as e:
         logger.error(f"Error initializing weekly broadcast table: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def set_weekly_broadcast(text: str):
     """Set weekly broadcast text"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("""
-                INSERT INTO weekly_broadcast (id, text) VALUES (1, %s)
-                ON CONFLICT (id) DO UPDATE SET text = EXCLUDED.text
-            """, (text,))
-        else:
-            cur.execute("INSERT OR REPLACE INTO weekly_broadcast (id, text) VALUES (1, ?)", (text,))
+            if USE_POSTGRES:
+                cur.execute("""
+                    INSERT INTO weekly_broadcast (id, text) VALUES (1, %s)
+                    ON CONFLICT (id) DO UPDATE SET text = EXCLUDED.text
+                """, (text,))
+            else:
+                cur.execute("""
+                    INSERT INTO weekly_broadcast (id, text) VALUES (1, ?)
+                    ON CONFLICT (id) DO UPDATE SET text = excluded.text
+                """, (text,))
         
-        conn.commit()
-        logger.info("Weekly broadcast text set successfully")
+            conn.commit()
+            _settings_cache.pop("weekly_text")
+            logger.info("Weekly broadcast text set successfully")
         
     except Exception as e:
         logger.error(f"Error setting weekly broadcast: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def get_weekly_broadcast() -> Optional[str]:
     """Get weekly broadcast text"""
+    cached = _settings_cache.get("weekly_text", CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return cached
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("SELECT text FROM weekly_broadcast WHERE id = %s", (1,))
-            row = cur.fetchone()
-            if row:
-                return row['text']
-        else:
-            cur.execute("SELECT text FROM weekly_broadcast WHERE id = ?", (1,))
-            result = cur.fetchone()
-            if result:
-                return result[0]
-            
-        return None
+            text = None
+            if USE_POSTGRES:
+                cur.execute("SELECT text FROM weekly_broadcast WHERE id = %s", (1,))
+                row = cur.fetchone()
+                if row:
+                    text = row['text']
+            else:
+                cur.execute("SELECT text FROM weekly_broadcast WHERE id = ?", (1,))
+                result = cur.fetchone()
+                if result:
+                    text = result[0]
+        
+        _settings_cache.set("weekly_text", text)
+        return text
         
     except Exception as e:
         logger.error(f"Error getting weekly broadcast: {e}")
         return None
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def set_weekly_time(day: int, hour: int, minute: int):
     """Set weekly broadcast time"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("""
-                INSERT INTO weekly_broadcast (id, day_of_week, hour, minute) VALUES (1, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE SET 
-                    day_of_week = EXCLUDED.day_of_week,
-                    hour = EXCLUDED.hour,
-                    minute = EXCLUDED.minute
-            """, (day, hour, minute))
-        else:
-            cur.execute("""
-                INSERT OR REPLACE INTO weekly_broadcast (id, day_of_week, hour, minute) 
-                VALUES (1, ?, ?, ?)
-            """, (day, hour, minute))
+            if USE_POSTGRES:
+                cur.execute("""
+                    INSERT INTO weekly_broadcast (id, day_of_week, hour, minute) VALUES (1, %s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET 
+                        day_of_week = EXCLUDED.day_of_week,
+                        hour = EXCLUDED.hour,
+                        minute = EXCLUDED.minute
+                """, (day, hour, minute))
+            else:
+                cur.execute("""
+                    INSERT INTO weekly_broadcast (id, day_of_week, hour, minute) VALUES (1, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET 
+                        day_of_week = excluded.day_of_week,
+                        hour = excluded.hour,
+                        minute = excluded.minute
+                """, (day, hour, minute))
         
-        conn.commit()
-        logger.info(f"Weekly broadcast time set: day={day}, hour={hour}, minute={minute}")
+            conn.commit()
+            _settings_cache.pop("weekly_time")
+            logger.info(f"Weekly broadcast time set: day={day}, hour={hour}, minute={minute}")
         
     except Exception as e:
         logger.error(f"Error setting weekly time: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
 def get_weekly_time() -> Tuple[int, int, int]:
     """Get weekly broadcast time"""
+    cached = _settings_cache.get("weekly_time", CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return cached
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
         
-        if USE_POSTGRES:
-            cur.execute("SELECT day_of_week, hour, minute FROM weekly_broadcast WHERE id = %s", (1,))
-            row = cur.fetchone()
-            if row:
-                return (row['day_of_week'], row['hour'], row['minute'])
-        else:
-            cur.execute("SELECT day_of_week, hour, minute FROM weekly_broadcast WHERE id = ?", (1,))
-            result = cur.fetchone()
-            if result:
-                return result
-                
-        # Default values if no record found
-        return (1, 10, 0)  # Monday, 10:00
+            # Default values if no record found
+            weekly_time = (1, 10, 0)  # Monday, 10:00
+            if USE_POSTGRES:
+                cur.execute("SELECT day_of_week, hour, minute FROM weekly_broadcast WHERE id = %s", (1,))
+                row = cur.fetchone()
+                if row:
+                    weekly_time = (row['day_of_week'], row['hour'], row['minute'])
+            else:
+                cur.execute("SELECT day_of_week, hour, minute FROM weekly_broadcast WHERE id = ?", (1,))
+                result = cur.fetchone()
+                if result:
+                    weekly_time = tuple(result)
+        
+        _settings_cache.set("weekly_time", weekly_time)
+        return weekly_time
         
     except Exception as e:
         logger.error(f"Error getting weekly time: {e}")
         return (1, 10, 0)  # Default values
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
 
-def add_purchase(user_id: int, amount: int):
-    """Add purchase and calculate cashback"""
+# Cashback tiers: Basic guest 5%, Silver guest 10% after 30 000 грн total spent
+SILVER_THRESHOLD = 30000
+BASIC_RATE_PERCENT = 5
+SILVER_RATE_PERCENT = 10
+
+def init_purchases_tables():
+    """Initialize purchases ledger and purchase_daily rollup tables"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                # PostgreSQL syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS purchases (
+                        id BIGSERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        amount INTEGER NOT NULL,
+                        cashback INTEGER NOT NULL,
+                        rate INTEGER NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS purchase_daily (
+                        day DATE PRIMARY KEY,
+                        purchases INTEGER DEFAULT 0,
+                        amount BIGINT DEFAULT 0,
+                        cashback BIGINT DEFAULT 0
+                    )
+                """)
+            else:
+                # SQLite syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS purchases (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        amount INTEGER NOT NULL,
+                        cashback INTEGER NOT NULL,
+                        rate INTEGER NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS purchase_daily (
+                        day TEXT PRIMARY KEY,
+                        purchases INTEGER DEFAULT 0,
+                        amount INTEGER DEFAULT 0,
+                        cashback INTEGER DEFAULT 0
+                    )
+                """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user_id ON purchases (user_id)")
+            
+            conn.commit()
+            logger.info("Purchases tables initialized successfully")
+        
+    except Exception as e:
+        logger.error(f"Error initializing purchases tables: {e}")
+
+def _apply_purchase(cur, user_id: int, amount: int) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Atomically add purchase to user balance using an open cursor.
+    Tier rate is computed in SQL from the new total.
+    Returns (new_bonus, new_total_spent, cashback, rate) or None if user not found
+    """
+    params = {"amount": amount, "threshold": SILVER_THRESHOLD, "silver": SILVER_RATE_PERCENT,
+              "basic": BASIC_RATE_PERCENT, "user_id": user_id}
+    if USE_POSTGRES:
+        cur.execute("""
+            UPDATE users
+            SET total_spent = total_spent + %(amount)s,
+                bonus_points = bonus_points + %(amount)s * CASE
+                    WHEN total_spent + %(amount)s >= %(threshold)s THEN %(silver)s ELSE %(basic)s
+                END / 100
+            WHERE user_id = %(user_id)s
+            RETURNING bonus_points, total_spent
+        """, params)
+        row = cur.fetchone()
+        result = (row['bonus_points'], row['total_spent']) if row else None
+    else:
+        cur.execute("""
+            UPDATE users
+            SET total_spent = total_spent + :amount,
+                bonus_points = bonus_points + :amount * CASE
+                    WHEN total_spent + :amount >= :threshold THEN :silver ELSE :basic
+                END / 100
+            WHERE user_id = :user_id
+            RETURNING bonus_points, total_spent
+        """, params)
+        result = cur.fetchone()
+    
+    if not result:
+        return None
+    new_bonus, new_total_spent = result
+    rate = SILVER_RATE_PERCENT if new_total_spent >= SILVER_THRESHOLD else BASIC_RATE_PERCENT
+    return new_bonus, new_total_spent, amount * rate // 100, rate
+
+def _record_purchases(cur, purchases: List[Tuple[int, int, int, int, datetime]]):
+    """Write (user_id, amount, cashback, rate, created_at) to ledger and update daily rollup"""
+    daily = {}
+    for _, amount, cashback, _, created_at in purchases:
+        day = created_at.date().isoformat()
+        count, total_amount, total_cashback = daily.get(day, (0, 0, 0))
+        daily[day] = (count + 1, total_amount + amount, total_cashback + cashback)
+    
+    if USE_POSTGRES:
+        cur.executemany("""
+            INSERT INTO purchases (user_id, amount, cashback, rate, created_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """, purchases)
+        cur.executemany("""
+            INSERT INTO purchase_daily (day, purchases, amount, cashback) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (day) DO UPDATE SET
+                purchases = purchase_daily.purchases + EXCLUDED.purchases,
+                amount = purchase_daily.amount + EXCLUDED.amount,
+                cashback = purchase_daily.cashback + EXCLUDED.cashback
+        """, [(day,) + totals for day, totals in daily.items()])
+    else:
+        cur.executemany("""
+            INSERT INTO purchases (user_id, amount, cashback, rate, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(u, a, c, r, ts.strftime("%Y-%m-%d %H:%M:%S")) for u, a, c, r, ts in purchases])
+        cur.executemany("""
+            INSERT INTO purchase_daily (day, purchases, amount, cashback) VALUES (?, ?, ?, ?)
+            ON CONFLICT (day) DO UPDATE SET
+                purchases = purchase_daily.purchases + excluded.purchases,
+                amount = purchase_daily.amount + excluded.amount,
+                cashback = purchase_daily.cashback + excluded.cashback
+        """, [(day,) + totals for day, totals in daily.items()])
+
+def add_purchase(user_id: int, amount: int) -> Optional[int]:
+    """
+    Add purchase and accrue cashback in one atomic UPDATE, write it to the purchases ledger.
+    Returns new bonus balance from the UPDATE (may be 0 - compare with None), None if user not found or on error
+    """
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            result = _apply_purchase(cur, user_id, amount)
+            if not result:
+                logger.error(f"User {user_id} not found")
+                return None
+            
+            new_bonus, new_total_spent, cashback, rate = result
+            _record_purchases(cur, [(user_id, amount, cashback, rate, datetime.utcnow())])
+            conn.commit()
+            logger.info(f"Purchase added for user {user_id}: amount={amount}, cashback={cashback}, new_total={new_total_spent}")
+            return new_bonus
         
-        # Get current user data
-        user = get_user(user_id)
-        if not user:
-            logger.error(f"User {user_id} not found")
-            return
+    except Exception as e:
+        logger.error(f"Error adding purchase: {e}")
+        return None
+
+def add_purchases_bulk(receipts: Iterable[Tuple[int, int, Optional[datetime]]]) -> Tuple[int, int]:
+    """
+    Import (user_id, amount, created_at) receipts (e.g. a POS shift) in one transaction.
+    created_at is UTC, None means now. Returns (imported, skipped) - skipped are unknown users
+    """
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            ledger = []
+            skipped = 0
+            now = datetime.utcnow()
+            for user_id, amount, created_at in receipts:
+                result = _apply_purchase(cur, user_id, amount)
+                if not result:
+                    skipped += 1
+                    continue
+                _, _, cashback, rate = result
+                ledger.append((user_id, amount, cashback, rate, created_at or now))
+            
+            if ledger:
+                _record_purchases(cur, ledger)
+            conn.commit()
+            logger.info(f"Bulk purchases imported: {len(ledger)}, skipped: {skipped}")
+            return len(ledger), skipped
         
-        phone, current_bonus, current_total = user
+    except Exception as e:
+        logger.error(f"Error importing purchases: {e}")
+        raise
+
+def get_daily_report(start_day: date, end_day: date) -> List[Tuple[str, int, int, int]]:
+    """Get daily totals from rollup - returns (day, purchases, amount, cashback)"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    SELECT day, purchases, amount, cashback FROM purchase_daily
+                    WHERE day BETWEEN %s AND %s ORDER BY day
+                """, (start_day, end_day))
+                return [(row['day'].isoformat(), row['purchases'], row['amount'], row['cashback']) for row in cur.fetchall()]
+            else:
+                cur.execute("""
+                    SELECT day, purchases, amount, cashback FROM purchase_daily
+                    WHERE day BETWEEN ? AND ? ORDER BY day
+                """, (start_day.isoformat(), end_day.isoformat()))
+                return cur.fetchall()
         
-        # Calculate new total spent
-        new_total_spent = current_total + amount
+    except Exception as e:
+        logger.error(f"Error getting daily report: {e}")
+        return []
+
+def use_bonus(user_id: int, amount: int) -> Optional[int]:
+    """
+    Use bonus points for payment in one conditional UPDATE.
+    Returns new bonus balance from the UPDATE (may be 0 - compare with None),
+    None if user not found / not enough bonus points
+    """
+    if amount <= 0:
+        logger.error(f"Invalid bonus amount for user {user_id}: {amount}")
+        return None
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    UPDATE users SET bonus_points = bonus_points - %s
+                    WHERE user_id = %s AND bonus_points >= %s
+                    RETURNING bonus_points
+                """, (amount, user_id, amount))
+                row = cur.fetchone()
+                new_bonus = row['bonus_points'] if row else None
+            else:
+                cur.execute("""
+                    UPDATE users SET bonus_points = bonus_points - ?
+                    WHERE user_id = ? AND bonus_points >= ?
+                    RETURNING bonus_points
+                """, (amount, user_id, amount))
+                row = cur.fetchone()
+                new_bonus = row[0] if row else None
+            
+            if new_bonus is None:
+                return None  # User not found or not enough bonus points
+            
+            conn.commit()
+            logger.info(f"Used {amount} bonus points for user {user_id}")
+            return new_bonus
         
-        # Calculate cashback rate based on total spent
-        if new_total_spent >= 30000:  # Silver guest
-            cashback_rate = 0.10
-        else:  # Basic guest
-            cashback_rate = 0.05
+    except Exception as e:
+        logger.error(f"Error using bonus: {e}")
+        return None
+
+def init_broadcast_jobs_tables():
+    """Initialize broadcast_jobs and broadcast_deliveries tables"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                # PostgreSQL syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                        id SERIAL PRIMARY KEY,
+                        text TEXT NOT NULL,
+                        status VARCHAR(16) DEFAULT 'running',
+                        last_user_id BIGINT DEFAULT 0,
+                        sent INTEGER DEFAULT 0,
+                        failed INTEGER DEFAULT 0,
+                        report_chat_id BIGINT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        finished_at TIMESTAMP
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                        job_id INTEGER NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        status VARCHAR(16) NOT NULL,
+                        error TEXT,
+                        delivered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (job_id, user_id)
+                    )
+                """)
+            else:
+                # SQLite syntax
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        text TEXT NOT NULL,
+                        status TEXT DEFAULT 'running',
+                        last_user_id INTEGER DEFAULT 0,
+                        sent INTEGER DEFAULT 0,
+                        failed INTEGER DEFAULT 0,
+                        report_chat_id INTEGER,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        finished_at DATETIME
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                        job_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        status TEXT NOT NULL,
+                        error TEXT,
+                        delivered_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (job_id, user_id)
+                    )
+                """)
+            
+            conn.commit()
+            logger.info("Broadcast jobs tables initialized successfully")
         
-        # Calculate cashback for this purchase
-        cashback = int(amount * cashback_rate)
-        new_bonus = current_bonus + cashback
+    except Exception as e:
+        logger.error(f"Error initializing broadcast jobs tables: {e}")
+
+def create_broadcast_job(text: str, report_chat_id: Optional[int] = None) -> Optional[int]:
+    """Create broadcast job - returns job id"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute(
+                    "INSERT INTO broadcast_jobs (text, report_chat_id) VALUES (%s, %s) RETURNING id",
+                    (text, report_chat_id)
+                )
+                job_id = cur.fetchone()['id']
+            else:
+                cur.execute(
+                    "INSERT INTO broadcast_jobs (text, report_chat_id) VALUES (?, ?)",
+                    (text, report_chat_id)
+                )
+                job_id = cur.lastrowid
+            
+            conn.commit()
+            logger.info(f"Broadcast job {job_id} created")
+            return job_id
         
-        # Update database
-        if USE_POSTGRES:
-            cur.execute("""
-                UPDATE users 
-                SET bonus_points = %s, total_spent = %s 
-                WHERE user_id = %s
-            """, (new_bonus, new_total_spent, user_id))
-        else:
+    except Exception as e:
+        logger.error(f"Error creating broadcast job: {e}")
+        return None
+
+def get_unfinished_broadcast_jobs() -> List[Tuple[int, str, int, Optional[int]]]:
+    """Get jobs that were not finished - returns (id, text, last_user_id, report_chat_id)"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
             cur.execute("""
-                UPDATE users 
-                SET bonus_points = ?, total_spent = ? 
-                WHERE user_id = ?
-            """, (new_bonus, new_total_spent, user_id))
+                SELECT id, text, last_user_id, report_chat_id FROM broadcast_jobs
+                WHERE status = 'running' ORDER BY id
+            """)
+            rows = cur.fetchall()
+            if USE_POSTGRES:
+                return [(row['id'], row['text'], row['last_user_id'], row['report_chat_id']) for row in rows]
+            return rows
         
-        conn.commit()
-        logger.info(f"Purchase added for user {user_id}: amount={amount}, cashback={cashback}, new_total={new_total_spent}")
+    except Exception as e:
+        logger.error(f"Error getting unfinished broadcast jobs: {e}")
+        return []
+
+def get_delivered_user_ids(job_id: int, from_user_id: int, to_user_id: int) -> List[int]:
+    """Get user ids in [from_user_id, to_user_id] that already have delivery record for job"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    SELECT user_id FROM broadcast_deliveries
+                    WHERE job_id = %s AND user_id BETWEEN %s AND %s
+                """, (job_id, from_user_id, to_user_id))
+                return [row['user_id'] for row in cur.fetchall()]
+            else:
+                cur.execute("""
+                    SELECT user_id FROM broadcast_deliveries
+                    WHERE job_id = ? AND user_id BETWEEN ? AND ?
+                """, (job_id, from_user_id, to_user_id))
+                return [row[0] for row in cur.fetchall()]
         
     except Exception as e:
-        logger.error(f"Error adding purchase: {e}")
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
+        logger.error(f"Error getting delivered user ids: {e}")
+        raise
 
-def use_bonus(user_id: int, amount: int) -> bool:
-    """Use bonus points for payment"""
+def record_broadcast_deliveries(job_id: int, deliveries: List[Tuple[int, str, Optional[str]]], last_user_id: Optional[int] = None):
+    """Save (user_id, status, error) delivery records and move job checkpoint in one transaction"""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with connection() as conn:
+            cur = conn.cursor()
+            sent = sum(1 for _, status, _ in deliveries if status == "sent")
+            failed = len(deliveries) - sent
+            
+            if USE_POSTGRES:
+                cur.executemany("""
+                    INSERT INTO broadcast_deliveries (job_id, user_id, status, error)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (job_id, user_id) DO NOTHING
+                """, [(job_id, user_id, status, error) for user_id, status, error in deliveries])
+                cur.execute("""
+                    UPDATE broadcast_jobs
+                    SET sent = sent + %s, failed = failed + %s,
+                        last_user_id = COALESCE(%s, last_user_id)
+                    WHERE id = %s
+                """, (sent, failed, last_user_id, job_id))
+            else:
+                cur.executemany("""
+                    INSERT OR IGNORE INTO broadcast_deliveries (job_id, user_id, status, error)
+                    VALUES (?, ?, ?, ?)
+                """, [(job_id, user_id, status, error) for user_id, status, error in deliveries])
+                cur.execute("""
+                    UPDATE broadcast_jobs
+                    SET sent = sent + ?, failed = failed + ?,
+                        last_user_id = COALESCE(?, last_user_id)
+                    WHERE id = ?
+                """, (sent, failed, last_user_id, job_id))
+            
+            conn.commit()
         
-        # Get current user data
-        user = get_user(user_id)
-        if not user:
-            return False
+    except Exception as e:
+        logger.error(f"Error recording broadcast deliveries: {e}")
+        raise
+
+def get_broadcast_job_stats(job_id: int) -> Tuple[int, int]:
+    """Get job totals - returns (sent, failed)"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("SELECT sent, failed FROM broadcast_jobs WHERE id = %s", (job_id,))
+                row = cur.fetchone()
+                if row:
+                    return (row['sent'], row['failed'])
+            else:
+                cur.execute("SELECT sent, failed FROM broadcast_jobs WHERE id = ?", (job_id,))
+                result = cur.fetchone()
+                if result:
+                    return result
+            return (0, 0)
         
-        phone, current_bonus, current_total = user
+    except Exception as e:
+        logger.error(f"Error getting broadcast job stats: {e}")
+        return (0, 0)
+
+def finish_broadcast_job(job_id: int):
+    """Mark broadcast job as done"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute(
+                    "UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (job_id,)
+                )
+            else:
+                cur.execute(
+                    "UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (job_id,)
+                )
+            
+            conn.commit()
+            logger.info(f"Broadcast job {job_id} finished")
         
-        if current_bonus < amount:
-            return False  # Not enough bonus points
+    except Exception as e:
+        logger.error(f"Error finishing broadcast job: {e}")
+
+def init_admins_table(seed_ids: Iterable[int] = ()):
+    """Initialize admins table (Telegram user IDs) and add seed_ids to it"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS admins (
+                        user_id BIGINT PRIMARY KEY,
+                        username TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                for user_id in seed_ids:
+                    cur.execute("INSERT INTO admins (user_id) VALUES (%s) ON CONFLICT (user_id) DO NOTHING", (user_id,))
+            else:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS admins (
+                        user_id INTEGER PRIMARY KEY,
+                        username TEXT,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                for user_id in seed_ids:
+                    cur.execute("INSERT INTO admins (user_id) VALUES (?) ON CONFLICT (user_id) DO NOTHING", (user_id,))
+            
+            conn.commit()
+            _settings_cache.pop("admin_ids")
+            logger.info("Admins table initialized successfully")
+        
+    except Exception as e:
+        logger.error(f"Error initializing admins table: {e}")
+
+def get_admin_ids() -> frozenset:
+    """Get user IDs of all admins (cached, invalidated by add_admin/remove_admin)"""
+    cached = _settings_cache.get("admin_ids", CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return cached
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT user_id FROM admins")
+            rows = cur.fetchall()
+            if USE_POSTGRES:
+                admin_ids = frozenset(row['user_id'] for row in rows)
+            else:
+                admin_ids = frozenset(row[0] for row in rows)
         
-        new_bonus = current_bonus - amount
+        _settings_cache.set("admin_ids", admin_ids)
+        return admin_ids
         
-        # Update database
-        if USE_POSTGRES:
-            cur.execute("UPDATE users SET bonus_points = %s WHERE user_id = %s", (new_bonus, user_id))
-        else:
-            cur.execute("UPDATE users SET bonus_points = ? WHERE user_id = ?", (new_bonus, user_id))
+    except Exception as e:
+        logger.error(f"Error getting admin ids: {e}")
+        return frozenset()
+
+def add_admin(user_id: int, username: Optional[str] = None) -> bool:
+    """Grant admin rights to Telegram user - returns False on error"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    INSERT INTO admins (user_id, username) VALUES (%s, %s)
+                    ON CONFLICT (user_id) DO UPDATE SET username = EXCLUDED.username
+                """, (user_id, username))
+            else:
+                cur.execute("""
+                    INSERT INTO admins (user_id, username) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET username = excluded.username
+                """, (user_id, username))
+            
+            conn.commit()
+            _settings_cache.pop("admin_ids")
+            logger.info(f"Admin {user_id} added")
+            return True
         
-        conn.commit()
-        logger.info(f"Used {amount} bonus points for user {user_id}")
-        return True
+    except Exception as e:
+        logger.error(f"Error adding admin: {e}")
+        return False
+
+def remove_admin(user_id: int) -> bool:
+    """Revoke admin rights - returns False if user was not an admin or on error"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("DELETE FROM admins WHERE user_id = %s", (user_id,))
+            else:
+                cur.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+            removed = cur.rowcount > 0
+            
+            conn.commit()
+            _settings_cache.pop("admin_ids")
+            logger.info(f"Admin {user_id} removed")
+            return removed
         
     except Exception as e:
-        logger.error(f"Error using bonus: {e}")
+        logger.error(f"Error removing admin: {e}")
         return False
-    finally:
-        if not USE_POSTGRES:
-            close_connection()
+
+def init_fsm_table():
+    """Initialize FSM storage table (state + JSON data per chat/user key)"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        key TEXT PRIMARY KEY,
+                        state TEXT,
+                        data TEXT NOT NULL DEFAULT '{}',
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            else:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        key TEXT PRIMARY KEY,
+                        state TEXT,
+                        data TEXT NOT NULL DEFAULT '{}',
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            
+            conn.commit()
+            logger.info("FSM table initialized successfully")
+        
+    except Exception as e:
+        logger.error(f"Error initializing FSM table: {e}")
+
+def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], str]]:
+    """Get (state, data_json) for FSM key - None if nothing stored"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("SELECT state, data FROM fsm_states WHERE key = %s", (key,))
+                row = cur.fetchone()
+                return (row['state'], row['data']) if row else None
+            else:
+                cur.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,))
+                row = cur.fetchone()
+                return (row[0], row[1]) if row else None
+        
+    except Exception as e:
+        logger.error(f"Error getting FSM record: {e}")
+        return None
+
+def save_fsm_record(key: str, state: Optional[str], data_json: str):
+    """Store FSM state and data for key (empty record is deleted). Raises on error, so callers don't cache unsaved state"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if state is None and data_json == "{}":
+                if USE_POSTGRES:
+                    cur.execute("DELETE FROM fsm_states WHERE key = %s", (key,))
+                else:
+                    cur.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+            elif USE_POSTGRES:
+                cur.execute("""
+                    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+                """, (key, state, data_json))
+            else:
+                cur.execute("""
+                    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """, (key, state, data_json))
+            
+            conn.commit()
+        
+    except Exception as e:
+        logger.error(f"Error saving FSM record: {e}")
+        raise
+
+def init_leases_table():
+    """Initialize leases table (which instance runs a scheduled/background job)"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS leases (
+                        name TEXT PRIMARY KEY,
+                        holder TEXT NOT NULL,
+                        expires_at DOUBLE PRECISION NOT NULL
+                    )
+                """)
+            else:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS leases (
+                        name TEXT PRIMARY KEY,
+                        holder TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                """)
+            
+            conn.commit()
+            logger.info("Leases table initialized successfully")
+        
+    except Exception as e:
+        logger.error(f"Error initializing leases table: {e}")
+
+def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """
+    Take or renew lease `name` for `ttl` seconds.
+
+    Succeeds if the lease is free, expired or already held by `holder`.
+    On PostgreSQL expiry is checked against the DB clock, so replica clocks don't matter.
+    """
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("""
+                    INSERT INTO leases (name, holder, expires_at)
+                    VALUES (%s, %s, EXTRACT(EPOCH FROM NOW()) + %s)
+                    ON CONFLICT (name) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+                    WHERE leases.holder = EXCLUDED.holder OR leases.expires_at < EXTRACT(EPOCH FROM NOW())
+                    RETURNING holder
+                """, (name, holder, ttl))
+            else:
+                now = time.time()
+                cur.execute("""
+                    INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                    WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+                    RETURNING holder
+                """, (name, holder, now + ttl, now))
+            acquired = cur.fetchone() is not None
+            
+            conn.commit()
+            return acquired
+        
+    except Exception as e:
+        logger.error(f"Error acquiring lease {name}: {e}")
+        return False
+
+def release_lease(name: str, holder: str):
+    """Release lease if it is still held by `holder`"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_POSTGRES:
+                cur.execute("DELETE FROM leases WHERE name = %s AND holder = %s", (name, holder))
+            else:
+                cur.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+            
+            conn.commit()
+        
+    except Exception as e:
+        logger.error(f"Error releasing lease {name}: {e}")
@@ -0,0 +1,133 @@
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out in time"""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived DB-API connections.
+
+    - size: maximum number of open connections
+    - health_check: callable(conn) that raises if connection is dead;
+      runs on checkout for connections idle longer than check_after seconds
+    - disconnect_errors: exceptions after which connection is discarded
+      and a new one is opened on the next checkout
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        size: int = 5,
+        health_check: Optional[Callable[[Any], None]] = None,
+        check_after: float = 30.0,
+        timeout: float = 30.0,
+        disconnect_errors: Tuple[Type[BaseException], ...] = (),
+        name: str = "db",
+    ):
+        self._connect = connect
+        self._health_check = health_check
+        self._check_after = check_after
+        self._timeout = timeout
+        self._disconnect_errors = disconnect_errors
+        self.size = size
+        self.name = name
+
+        self._idle = queue.LifoQueue()  # (conn, last_used)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    @property
+    def opened(self) -> int:
+        return self._opened
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._opened += 1
+        logger.info(f"[{self.name}] Opened new connection ({self._opened}/{self.size})")
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if getattr(conn, "closed", False):  # psycopg2
+            return False
+        if self._health_check is None or time.monotonic() - last_used < self._check_after:
+            return True
+        try:
+            self._health_check(conn)
+            return True
+        except Exception as e:
+            logger.warning(f"[{self.name}] Health check failed, reconnecting: {e}")
+            return False
+
+    def acquire(self):
+        """Check out a connection (blocks while pool is exhausted)"""
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolTimeout(f"[{self.name}] No free connection after {self._timeout}s")
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open()
+                if self._is_healthy(conn, last_used):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        """Return a connection to the pool"""
+        try:
+            if broken:
+                self._discard(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager: check out, roll back on error, return to pool"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except BaseException as e:
+            broken = isinstance(e, self._disconnect_errors)
+            raise
+        finally:
+            if not broken:
+                # Завершуємо незакомічену транзакцію (no-op після commit)
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            self.release(conn, broken=broken)
+
+    def close_all(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
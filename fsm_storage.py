@@ -0,0 +1,79 @@
+import os
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+import async_db
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Скільки секунд стан FSM живе в пам'яті процесу. Запис іде одразу в БД (write-through),
+# тож для одного інстансу кеш завжди актуальний. Якщо кілька реплік обробляють апдейти
+# одного чату - задайте FSM_CACHE_TTL=0, щоб кожен апдейт читав стан з БД.
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "300"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+_EMPTY: Tuple[Optional[str], Dict[str, Any]] = (None, {})
+
+
+class DBStorage(BaseStorage):
+    """
+    FSM storage in the bot database (table fsm_states) with write-through cache.
+
+    Admin flows (waiting_for_broadcast, ...) survive restarts and can be shared
+    between instances without Redis.
+    """
+
+    def __init__(self, cache_ttl: float = FSM_CACHE_TTL, cache_size: int = FSM_CACHE_SIZE,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = LRUCache(maxsize=cache_size, ttl=cache_ttl, name="fsm") if cache_ttl > 0 else None
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        if self._cache is not None:
+            record = self._cache.get(key)
+            if record is not None:
+                return record
+        row = await async_db.get_fsm_record(key)
+        record = (row[0], json.loads(row[1])) if row else _EMPTY
+        if self._cache is not None:
+            self._cache.set(key, record)
+        return record
+
+    async def _save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        # Кеш оновлюється лише після успішного запису: інакше цей процес бачив би стан,
+        # якого немає в БД (і не буде ні в інших воркерах, ні після перезапуску)
+        try:
+            await async_db.save_fsm_record(key, state, json.dumps(data, ensure_ascii=False))
+        except Exception:
+            if self._cache is not None:
+                self._cache.pop(key)
+            raise
+        if self._cache is not None:
+            self._cache.set(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key = self.key_builder.build(key)
+        _, data = await self._load(db_key)
+        await self._save(db_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        db_key = self.key_builder.build(key)
+        state, _ = await self._load(db_key)
+        await self._save(db_key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        if self._cache is not None:
+            self._cache.clear()
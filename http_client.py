@@ -0,0 +1,115 @@
+"""
+Спільний HTTP-клієнт процесу: одна aiohttp.ClientSession з keep-alive для Telegram API
+(сесія бота) і внутрішніх запитів (keep-alive ping), замість нової сесії і TLS-рукостискання
+на кожен запит.
+"""
+import os
+import ssl
+import time
+import logging
+from typing import Optional
+
+import certifi
+from aiogram.__meta__ import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+import metrics
+from broadcast_engine import BROADCAST_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Одночасних з'єднань: паралельні відправки розсилки + запас для обробників і ping
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", str(BROADCAST_CONCURRENCY + 20)))
+# Скільки тримати вільне з'єднання: довше за інтервал keep-alive ping (2 хв), щоб і він не відкривав нове
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "150"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))  # на весь запит (long polling додає свій час)
+
+_session: Optional[ClientSession] = None
+
+connections_created = metrics.Counter("bot_http_connections_created_total", "New outbound HTTP connections (TCP+TLS)")
+connections_reused = metrics.Counter("bot_http_connections_reused_total", "Outbound requests sent over a kept-alive connection")
+connection_wait = metrics.Histogram("bot_http_connection_wait_seconds", "Time waiting for a free connection in the pool",
+                                    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+dns_lookups = metrics.Counter("bot_http_dns_lookups_total", "DNS lookups by result", ("result",))
+
+
+def _trace_config() -> TraceConfig:
+    trace = TraceConfig()
+
+    async def on_create_end(session, context, params):
+        connections_created.inc()
+
+    async def on_reuse(session, context, params):
+        connections_reused.inc()
+
+    async def on_queued_start(session, context, params):
+        context.queued_at = time.perf_counter()
+
+    async def on_queued_end(session, context, params):
+        connection_wait.observe(time.perf_counter() - context.queued_at)
+
+    async def on_dns_hit(session, context, params):
+        dns_lookups.inc("cache_hit")
+
+    async def on_dns_miss(session, context, params):
+        dns_lookups.inc("cache_miss")
+
+    trace.on_connection_create_end.append(on_create_end)
+    trace.on_connection_reuseconn.append(on_reuse)
+    trace.on_connection_queued_start.append(on_queued_start)
+    trace.on_connection_queued_end.append(on_queued_end)
+    trace.on_dns_cache_hit.append(on_dns_hit)
+    trace.on_dns_cache_miss.append(on_dns_miss)
+    return trace
+
+
+async def get_session() -> ClientSession:
+    """Shared session of this process (created on first use inside the running loop)"""
+    global _session
+    if _session is None or _session.closed:
+        connector = TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+        )
+        _session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+            trace_configs=[_trace_config()],
+        )
+        logger.info(f"🌐 HTTP-клієнт: до {HTTP_POOL_LIMIT} з'єднань, keep-alive {HTTP_KEEPALIVE_TIMEOUT:.0f} с")
+    return _session
+
+
+async def close():
+    """Close shared session (call once on application shutdown, after the bot has stopped)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+class SharedAiohttpSession(AiohttpSession):
+    """
+    Bot session on top of the shared ClientSession.
+
+    bot.session.close() (called by aiogram on shutdown) leaves the shared session open;
+    it is closed by http_client.close().
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        super().__init__(**kwargs)
+
+    async def create_session(self) -> ClientSession:
+        return await get_session()
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,94 @@
+"""
+Клавіатури бота, побудовані один раз при імпорті.
+
+Моделі aiogram незмінні (frozen), тому ті самі екземпляри безпечно
+повторно використовувати в кожній відповіді замість побудови нових.
+"""
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+
+# --- Тексти кнопок ---
+BTN_ADMIN_PANEL = "⚙️ Адмін-панель"
+BTN_QR = "📱 Мій QR-код"
+BTN_CASHBACK = "💰 Кешбек"
+BTN_MENU = "🍽 Меню закладу"
+BTN_DELIVERY = "🛵 Доставка"
+BTN_BOOKING = "📅 Забронювати столик"
+BTN_PROMOS = "🏷 Акції"
+BTN_BACK = "‹ Повернутись до меню"
+BTN_SHARE_PHONE = "📱 Поділитися номером телефону"
+
+BTN_ONCE_BROADCAST = "📢 Одноразова розсилка"
+BTN_WEEKLY_BROADCAST = "🔁 Тижнева розсилка"
+BTN_EDIT_WEEKLY_TEXT = "✏️ Редагувати текст тижневої розсилки"
+BTN_EDIT_WEEKLY_TIME = "⏰ Редагувати час тижневої розсилки"
+BTN_EDIT_PROMOS = "📝 Редагувати акції"
+BTN_SEND_WEEKLY = "✅ Надіслати тижневу розсилку"
+
+BTN_ADD_PROMO = "➕ Додати акцію"
+BTN_EDIT_PROMO = "✏️ Редагувати акцію"
+BTN_DELETE_PROMO = "❌ Видалити акцію"
+
+
+def _reply(*rows) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=text) for text in row] for row in rows],
+        resize_keyboard=True,
+    )
+
+
+_MAIN_ROWS = [[BTN_QR], [BTN_CASHBACK], [BTN_MENU], [BTN_DELIVERY], [BTN_BOOKING], [BTN_PROMOS]]
+
+# --- Reply-клавіатури ---
+MAIN_MENU = _reply(*_MAIN_ROWS)
+MAIN_MENU_ADMIN = _reply([BTN_ADMIN_PANEL], *_MAIN_ROWS)
+BACK_MENU = _reply([BTN_BACK])
+SHARE_PHONE = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text=BTN_SHARE_PHONE, request_contact=True)]],
+    resize_keyboard=True,
+)
+ADMIN_PANEL = _reply(
+    [BTN_ONCE_BROADCAST],
+    [BTN_WEEKLY_BROADCAST],
+    [BTN_EDIT_WEEKLY_TEXT],
+    [BTN_EDIT_WEEKLY_TIME],
+    [BTN_EDIT_PROMOS],
+    [BTN_BACK],
+)
+WEEKLY_SEND = _reply([BTN_SEND_WEEKLY], [BTN_BACK])
+PROMO_ACTIONS = _reply([BTN_ADD_PROMO], [BTN_EDIT_PROMO], [BTN_DELETE_PROMO], [BTN_BACK])
+
+# --- Inline-клавіатури ---
+_INLINE_BACK = InlineKeyboardButton(text=BTN_BACK, callback_data="back_to_menu")
+
+MENU_LINK_INLINE = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Меню закладу", url="https://lemon.choiceqr.com/")],
+        [_INLINE_BACK],
+    ]
+)
+DELIVERY_INLINE = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Bolt Food", url="https://food.bolt.eu/en-US/990/p/134325-lemon?utm_source=share_provider&utm_medium=product&utm_content=menu_header")],
+        [_INLINE_BACK],
+    ]
+)
+BOOKING_INLINE = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Скопіювати номер", callback_data="copy_phone")],
+        [InlineKeyboardButton(text="Instagram", url="https://www.instagram.com/lemon.gastrobar.if?igsh=emxlN3dnZW11dWJ4")],
+        [_INLINE_BACK],
+    ]
+)
+
+
+def get_main_menu(is_admin: bool = False) -> ReplyKeyboardMarkup:
+    return MAIN_MENU_ADMIN if is_admin else MAIN_MENU
+
+
+def get_back_menu() -> ReplyKeyboardMarkup:
+    return BACK_MENU
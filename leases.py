@@ -0,0 +1,98 @@
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import async_db
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_NAME = os.getenv("INSTANCE_ID") or socket.gethostname()
+_token = uuid.uuid4().hex[:6]
+
+LEASE_TTL = float(os.getenv("LEASE_TTL", "60"))
+
+def instance_id() -> str:
+    """Unique holder id of this process among all replicas and workers"""
+    # pid береться при виклику: воркери, створені через fork, отримують різні ID
+    return f"{INSTANCE_NAME}:{os.getpid()}:{_token}"
+
+
+class LeaseLost(Exception):
+    """Lease held by hold() could not be renewed; the block was cancelled"""
+
+
+# Оренди, які цей процес утримує зараз (щоб не запустити ту саму роботу двічі в одному процесі)
+_held = set()
+
+
+async def try_acquire(name: str, ttl: float) -> bool:
+    """
+    Take lease for `ttl` seconds without releasing it.
+
+    For "once per period" jobs: every replica's scheduler fires at the same
+    minute, the first one takes the lease and the rest skip the run.
+    """
+    acquired = await async_db.acquire_lease(name, instance_id(), ttl)
+    if not acquired:
+        logger.debug(f"Оренда {name} зайнята іншим інстансом")
+    return acquired
+
+
+def is_held(name: str) -> bool:
+    """Lease is held by this process right now"""
+    return name in _held
+
+
+@asynccontextmanager
+async def hold(name: str, ttl: float = LEASE_TTL) -> AsyncIterator[bool]:
+    """
+    Hold lease while the block runs, renewing it in background; yields False if it is taken.
+
+    If this process dies, the lease expires after `ttl` and another instance can take over.
+    If a renewal fails (lease taken over or DB error), the task running the block is
+    cancelled and LeaseLost is raised from the block, so the work is never done by two instances.
+    """
+    if name in _held:
+        yield False
+        return
+    _held.add(name)  # до await, щоб друга задача цього ж процесу не взяла ту саму оренду
+    if not await async_db.acquire_lease(name, instance_id(), ttl):
+        _held.discard(name)
+        yield False
+        return
+
+    owner = asyncio.current_task()
+    lost = False
+
+    async def renew():
+        nonlocal lost
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                renewed = await async_db.acquire_lease(name, instance_id(), ttl)
+            except Exception as e:
+                logger.error(f"❌ Помилка продовження оренди {name}: {e}")
+                renewed = False
+            if not renewed:
+                # Не можемо гарантувати, що оренда ще наша: зупиняємо роботу до закінчення TTL
+                logger.error(f"❌ Оренду {name} втрачено, роботу зупинено")
+                lost = True
+                owner.cancel()
+                return
+
+    renewer = asyncio.create_task(renew())
+    try:
+        yield True
+    except asyncio.CancelledError:
+        if not lost:
+            raise
+        owner.uncancel()
+        raise LeaseLost(name) from None
+    finally:
+        renewer.cancel()
+        _held.discard(name)
+        await async_db.release_lease(name, instance_id())
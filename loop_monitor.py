@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from aiohttp import web
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Як часто перевіряти затримку event loop (секунд)
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+# Блокування loop довше за цей поріг логуються разом зі стеком (секунд)
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", "0.1"))
+# Скільки останніх вимірів тримати для перцентилів (3000 x 0.1 с = 5 хвилин)
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "3000"))
+STACK_LIMIT = 12
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _project_frames(frame) -> Iterator[Any]:
+    """Frames of our own modules, innermost first"""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PROJECT_DIR) and "site-packages" not in filename:
+            yield frame
+        frame = frame.f_back
+
+
+class LoopMonitor:
+    """
+    Event loop watchdog running in a daemon thread.
+
+    Every `interval` it posts a callback to the loop and measures how late it runs
+    (loop lag). If the callback is still pending after `threshold`, some code holds
+    the loop (sync DB call, QR render, ...): the thread grabs the loop thread's
+    stack at that moment and, when the loop recovers, logs the stall with the
+    handler and db.py function that caused it.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = SLOW_CALLBACK_THRESHOLD,
+                 window: int = LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.slow_callbacks = 0
+        self.last_slow: Optional[Dict[str, Any]] = None
+        self._samples: deque = deque(maxlen=window)
+        self._handlers: Dict[asyncio.Task, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._last_ping: Optional[float] = None
+        self._pending: Optional[float] = None  # коли надіслано ще не виконаний ping
+        self._stall: Optional[Dict[str, Any]] = None  # зупинка саме цього ping (stall["sent"] == _pending)
+        self._lock = threading.Lock()  # передача _pending/_stall між потоком і loop
+
+    @contextmanager
+    def handling(self, name: str):
+        """Mark current task as running handler `name` (for stall attribution)"""
+        task = asyncio.current_task()
+        self._handlers[task] = name
+        try:
+            yield
+        finally:
+            self._handlers.pop(task, None)
+
+    def _pong(self, sent: float):
+        """Runs on the loop: records lag of the ping and logs stall if there was one"""
+        lag = time.monotonic() - sent
+        with self._lock:
+            self._pending = None
+            stall, self._stall = self._stall, None
+        if stall is not None and stall["sent"] != sent:
+            stall = None
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._samples.append(lag)
+        metrics.loop_lag.observe(lag)
+
+        if stall is not None:
+            self.slow_callbacks += 1
+            stall["duration"] = round(lag, 4)
+            self.last_slow = {key: value for key, value in stall.items() if key not in ("stack", "sent")}
+            metrics.slow_callbacks.inc(stall["handler"])
+            logger.warning(
+                f"🐢 Event loop заблоковано на {lag * 1000:.0f} мс: обробник {stall['handler']}, "
+                f"БД {stall['db_function'] or '-'}, місце {stall['location'] or '-'}\n{stall['stack']}"
+            )
+
+    def _capture(self) -> Dict[str, Any]:
+        """Runs in watchdog thread while the loop is blocked"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            handler = "-"
+        else:
+            handler = self._handlers.get(task) or getattr(task.get_coro(), "__qualname__", task.get_name())
+
+        own = list(_project_frames(frame))
+        db_function = next((f.f_code.co_name for f in own if os.path.basename(f.f_code.co_filename) == "db.py"), None)
+        location = None
+        if own:
+            location = f"{os.path.basename(own[0].f_code.co_filename)}:{own[0].f_lineno} {own[0].f_code.co_name}"
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else ""
+        return {"handler": handler, "db_function": db_function, "location": location,
+                "at": time.strftime("%Y-%m-%d %H:%M:%S"), "stack": stack}
+
+    def _watch(self):
+        tick = min(self.interval, self.threshold / 2)
+        while not self._stopped.wait(tick):
+            now = time.monotonic()
+            with self._lock:
+                pending, stalled = self._pending, self._stall is not None
+            if pending is None:
+                if self._last_ping is not None and now - self._last_ping < self.interval:
+                    continue
+                with self._lock:
+                    self._pending = self._last_ping = now
+                try:
+                    self._loop.call_soon_threadsafe(self._pong, now)
+                except RuntimeError:  # loop закрито
+                    return
+            elif not stalled and now - pending > self.threshold:
+                stall = self._capture()
+                stall["sent"] = pending
+                with self._lock:
+                    # Поки знімали стек, ping міг виконатися: тоді ця зупинка вже нічия
+                    if self._pending == pending:
+                        self._stall = stall
+
+    def start(self):
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self._last_ping = None
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+            self._thread.start()
+            logger.info(f"⏱ Моніторинг event loop запущено (кожні {self.interval} с, поріг {self.threshold} с)")
+
+    async def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            with self._lock:
+                self._pending = self._stall = None
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self._samples)
+        return {
+            "samples": len(ordered),
+            "p50": round(_percentile(ordered, 0.50), 4),
+            "p95": round(_percentile(ordered, 0.95), 4),
+            "p99": round(_percentile(ordered, 0.99), 4),
+            "max": round(ordered[-1], 4) if ordered else 0.0,
+            "max_since_start": round(self.max_lag, 4),
+            "slow_callbacks": self.slow_callbacks,
+            "last_slow": self.last_slow,
+        }
+
+
+monitor = LoopMonitor()
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    """aiohttp route: GET /health - status and event loop lag percentiles (seconds)"""
+    return web.json_response({"status": "OK", "event_loop_lag": monitor.stats()})
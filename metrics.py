@@ -0,0 +1,213 @@
+"""
+Мінімальні метрики у форматі Prometheus (text exposition 0.0.4) без зовнішніх залежностей.
+
+Метрики оновлюються з event loop і з потоків БД, тому кожна серія захищена локом
+(неконкурентний lock коштує десятки наносекунд).
+"""
+import time
+import bisect
+import functools
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from aiohttp import web
+
+import cache
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # Дві сім'ї з одним ім'ям дали б дублікати "# TYPE", які Prometheus відкидає
+        if any(metric.name == name for metric in _registry):
+            raise ValueError(f"Metric {name} is already registered")
+        _registry.append(self)
+
+    def samples(self) -> Iterable[Tuple[str, Labels, str, float]]:
+        """(suffix, label values, extra label, value)"""
+        return ()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [("", labels, "", value) for labels, value in items]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, list] = {}  # labels -> [bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (counts[:], total, count)) for labels, (counts, total, count) in self._series.items()]
+        result = []
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                result.append(("_bucket", labels, f'le="{_format_value(bound)}"', cumulative))
+            result.append(("_sum", labels, "", total))
+            result.append(("_count", labels, "", count))
+        return result
+
+
+class CallbackMetric(_Metric):
+    """Metric whose samples are read at scrape time from `func` -> [(label values, value)]"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 func: Callable[[], Iterable[Tuple[Labels, float]]], type: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+        self.type = type
+
+    def samples(self):
+        return [("", labels, "", value) for labels, value in self.func()]
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """aiohttp route: GET /metrics"""
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+# --- Метрики бота ---
+handler_latency = Histogram("bot_handler_duration_seconds", "Update handler latency", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by update handlers", ("handler",))
+db_latency = Histogram("bot_db_query_duration_seconds", "db.py function latency (in DB thread)", ("function",))
+db_errors = Counter("bot_db_errors_total", "Exceptions raised by db.py functions", ("function",))
+broadcast_messages = Counter("bot_broadcast_messages_total", "Broadcast messages by result", ("result",))
+broadcast_retries = Counter("bot_broadcast_retry_after_total", "RetryAfter responses during broadcasts")
+broadcast_rate = Gauge("bot_broadcast_last_rate", "Messages per second of the last broadcast batch")
+loop_lag = Histogram("bot_event_loop_lag_seconds", "Event loop scheduling delay",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+slow_callbacks = Counter("bot_slow_callbacks_total", "Event loop stalls above threshold by handler", ("handler",))
+
+
+def _cache_samples(attr: str):
+    return lambda: [((c.name,), getattr(c, attr)) for c in cache.all_caches()]
+
+
+def _cache_hit_ratio():
+    return [((c.name,), c.hits / (c.hits + c.misses)) for c in cache.all_caches() if c.hits + c.misses]
+
+
+CallbackMetric("bot_cache_hits_total", "LRU cache hits", ("cache",), _cache_samples("hits"), type="counter")
+CallbackMetric("bot_cache_misses_total", "LRU cache misses", ("cache",), _cache_samples("misses"), type="counter")
+CallbackMetric("bot_cache_hit_ratio", "LRU cache hit ratio since start", ("cache",), _cache_hit_ratio)
+CallbackMetric("bot_cache_entries", "LRU cache size", ("cache",), lambda: [((c.name,), len(c)) for c in cache.all_caches()])
+
+
+# Черга апдейтів процесу; метрики створюються один раз і читають ту, що зареєстрована останньою
+_update_queue = None
+
+
+def _queue_samples(func):
+    return lambda: [] if _update_queue is None else func(_update_queue)
+
+
+CallbackMetric("bot_update_queue_depth", "Updates waiting in queue", (),
+               _queue_samples(lambda queue: [((), queue.depth)]))
+CallbackMetric("bot_update_queue_rejected_total", "Updates rejected because queue was full", (),
+               _queue_samples(lambda queue: [((), queue.rejected)]), type="counter")
+CallbackMetric("bot_update_queue_shard_lag_seconds", "Delay from enqueue to handling per shard (EWMA)", ("shard",),
+               _queue_samples(lambda queue: [((str(i),), shard["avg_lag"])
+                                             for i, shard in enumerate(queue.stats()["shards"])]))
+
+
+def register_update_queue(queue):
+    """Export depth and per-shard lag of update_queue.UpdateQueue (replaces previously registered queue)"""
+    global _update_queue
+    _update_queue = queue
+
+
+def timed_db(func):
+    """Record latency and exceptions of a db.py function (runs in DB executor thread)"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            db_errors.inc(name)
+            raise
+        finally:
+            db_latency.observe(time.perf_counter() - started, name)
+    return wrapper
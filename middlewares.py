@@ -0,0 +1,111 @@
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import TelegramObject, User
+
+import async_db
+import metrics
+import profiling
+from loop_monitor import monitor as loop_monitor
+from config import ADMIN_USERNAMES
+from text_router import TextRouter
+
+logger = logging.getLogger(__name__)
+
+
+def is_admin(user: Optional[User], admin_ids: frozenset = frozenset()) -> bool:
+    """Admin by Telegram user ID (admins table) or by username from ADMIN_USERNAMES"""
+    if user is None:
+        return False
+    return user.id in admin_ids or user.username in ADMIN_USERNAMES
+
+
+class AdminMiddleware(BaseMiddleware):
+    """
+    Resolves admin rights once per update and passes them to handlers
+    as `is_admin_user` (handlers declare the argument if they need it).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # event_from_user - справжній автор апдейту (для callback це не бот, що надіслав повідомлення)
+        admin_ids = await async_db.get_admin_ids()
+        data["is_admin_user"] = is_admin(data.get("event_from_user"), admin_ids)
+        return await handler(event, data)
+
+
+def handler_name(handler: Optional[HandlerObject], event: TelegramObject,
+                 text_router: Optional[TextRouter] = None) -> str:
+    """Name of the function that handles event (buttons are resolved through text router)"""
+    if handler is None:
+        return "unknown"
+    if text_router is not None and handler.callback == text_router.dispatch:
+        return text_router.handler_name(getattr(event, "text", None))
+    return getattr(handler.callback, "__name__", "unknown")
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Records latency and exceptions of matched handlers (inner middleware)"""
+
+    def __init__(self, text_router: Optional[TextRouter] = None):
+        self.text_router = text_router
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = handler_name(data.get("handler"), event, self.text_router)
+        started = time.perf_counter()
+        try:
+            with loop_monitor.handling(name):
+                return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(name)
+            raise
+        finally:
+            metrics.handler_latency.observe(time.perf_counter() - started, name)
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Traces a sampled fraction of handled updates (see profiling.py)"""
+
+    def __init__(self, text_router: Optional[TextRouter] = None, profiler: profiling.Profiler = profiling.profiler):
+        self.text_router = text_router
+        self.profiler = profiler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.profiler.sampled():
+            return await handler(event, data)
+        update = data.get("event_update")
+        with self.profiler.trace(handler_name(data.get("handler"), event, self.text_router),
+                                 update_id=update.update_id if update else None):
+            return await handler(event, data)
+
+
+def setup_middlewares(dp: Dispatcher, text_router: Optional[TextRouter] = None):
+    admin_middleware = AdminMiddleware()
+    dp.message.outer_middleware(admin_middleware)
+    dp.callback_query.outer_middleware(admin_middleware)
+
+    metrics_middleware = MetricsMiddleware(text_router)
+    dp.message.middleware(metrics_middleware)
+    dp.callback_query.middleware(metrics_middleware)
+
+    if profiling.ENABLED:
+        profiling_middleware = ProfilingMiddleware(text_router)
+        dp.message.middleware(profiling_middleware)
+        dp.callback_query.middleware(profiling_middleware)
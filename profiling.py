@@ -0,0 +1,184 @@
+"""
+Вибіркове профілювання апдейтів: обробник -> запити до БД -> виклики Telegram API.
+
+Вмикається змінною PROFILE_SAMPLE_RATE (частка апдейтів, 0..1). Коли вона 0,
+middleware і обгортки не реєструються взагалі, тож накладних витрат немає.
+
+Трейси пишуться пачками в PROFILE_DIR:
+- traces-<pid>.jsonl - дерево спанів кожного апдейту (JSON на рядок);
+- stacks-<pid>.folded - collapsed stacks для flamegraph.pl / speedscope (власний час у мікросекундах).
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_FLUSH_EVERY = int(os.getenv("PROFILE_FLUSH_EVERY", "50"))  # трейсів
+
+ENABLED = PROFILE_SAMPLE_RATE > 0
+
+
+class Span:
+    __slots__ = ("name", "kind", "start", "end", "children", "error")
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        result = {
+            "name": self.name,
+            "kind": self.kind,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.error:
+            result["error"] = self.error
+        if self.children:
+            result["children"] = [child.to_dict(origin) for child in self.children]
+        return result
+
+    def fold(self, prefix: str, stacks: Counter):
+        """Add self time (duration minus children) of this span and its children to collapsed stacks"""
+        path = f"{prefix};{self.kind}:{self.name}" if prefix else f"{self.kind}:{self.name}"
+        self_time = self.duration - sum(child.duration for child in self.children)
+        # Паралельні дочірні спани (gather) можуть перекривати один одного
+        stacks[path] += max(0, int(self_time * 1_000_000))
+        for child in self.children:
+            child.fold(path, stacks)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("profiling_span", default=None)
+
+
+@contextmanager
+def span(name: str, kind: str):
+    """Child span of the current trace; does nothing if this update is not sampled"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, kind)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+class Profiler:
+    """Collects sampled traces and writes them to PROFILE_DIR in batches (off the event loop)"""
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, directory: str = PROFILE_DIR,
+                 flush_every: int = PROFILE_FLUSH_EVERY):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._traces: List[Dict[str, Any]] = []
+        self._stacks: Counter = Counter()
+
+    def sampled(self) -> bool:
+        return random.random() < self.sample_rate
+
+    @contextmanager
+    def trace(self, name: str, kind: str = "handler", **attrs: Any):
+        """Root span of one update"""
+        root = Span(name, kind)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            root.end = time.perf_counter()
+            _current_span.reset(token)
+            self._record(root, attrs)
+
+    def _record(self, root: Span, attrs: Dict[str, Any]):
+        self._traces.append({"ts": round(time.time(), 3), **attrs, **root.to_dict(root.start)})
+        root.fold("", self._stacks)
+        self.recorded += 1
+        if len(self._traces) >= self.flush_every:
+            asyncio.get_running_loop().run_in_executor(None, self._write, *self._take())
+
+    def _take(self):
+        traces, stacks = self._traces, self._stacks
+        self._traces, self._stacks = [], Counter()
+        return traces, stacks
+
+    def _write(self, traces: List[Dict[str, Any]], stacks: Counter):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            pid = os.getpid()
+            with open(os.path.join(self.directory, f"traces-{pid}.jsonl"), "a", encoding="utf-8") as f:
+                for item in traces:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            with open(os.path.join(self.directory, f"stacks-{pid}.folded"), "a", encoding="utf-8") as f:
+                for path, micros in stacks.items():
+                    if micros:
+                        f.write(f"{path} {micros}\n")
+        except OSError as e:
+            logger.error(f"❌ Не вдалося записати профілі в {self.directory}: {e}")
+
+    async def flush(self):
+        """Write buffered traces (call on shutdown)"""
+        if self._traces:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, *self._take())
+
+
+profiler = Profiler()
+
+
+def traced_db(func):
+    """Span around an async db call (time as seen by the handler, incl. waiting for a DB thread)"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with span(name, "db"):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+class RequestSpanMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: span for every outgoing Telegram API call of a sampled update"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        with span(type(method).__api_method__, "api"):
+            return await make_request(bot, method)
+
+
+def setup_session(bot: Bot):
+    """Register API call spans on bot session (only if profiling is enabled)"""
+    if ENABLED:
+        bot.session.middleware(RequestSpanMiddleware())
+        logger.info(f"🔬 Профілювання увімкнено: {PROFILE_SAMPLE_RATE:.1%} апдейтів -> {PROFILE_DIR}/")
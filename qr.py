@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List, Optional, Sequence
+
+import qrcode
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+import async_db
+import profiling
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Параметри рендерингу QR-коду
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+
+# Кеш готових PNG в пам'яті та (опційно) на диску
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "512"))
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR")  # напр. /tmp/qr_cache; якщо не задано - тільки пам'ять
+
+_png_cache = LRUCache(maxsize=QR_CACHE_SIZE, name="qr_png")
+# file_id фото, яке Telegram вже зберіг - повторна відправка без завантаження
+_file_id_cache = LRUCache(maxsize=int(os.getenv("QR_FILE_ID_CACHE_SIZE", "10000")), name="qr_file_id")
+
+# Процеси для рендерингу (PIL тримає GIL, тому не потоки)
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+
+def render_qr_png(data: str, box_size: int = QR_BOX_SIZE, border: int = QR_BORDER) -> bytes:
+    """Render QR code to PNG bytes (CPU-bound, call off the event loop)"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    bio = BytesIO()
+    img.save(bio, "PNG")
+    return bio.getvalue()
+
+
+def cache_key(data: str, box_size: int = QR_BOX_SIZE, border: int = QR_BORDER) -> str:
+    """Cache key for QR content + render params (hashed: phone numbers are not stored as file names)"""
+    return hashlib.sha1(f"{data}|{box_size}|{border}".encode()).hexdigest()
+
+
+def _disk_path(key: str) -> Optional[str]:
+    if not QR_CACHE_DIR:
+        return None
+    return os.path.join(QR_CACHE_DIR, f"{key}.png")
+
+
+def _read_disk(key: str) -> Optional[bytes]:
+    path = _disk_path(key)
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return None
+
+
+def _write_disk(key: str, png: bytes):
+    path = _disk_path(key)
+    if not path:
+        return
+    os.makedirs(QR_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+
+
+def _load_or_render(data: str, key: str) -> bytes:
+    png = _read_disk(key)
+    if png is None:
+        png = render_qr_png(data)
+        try:
+            _write_disk(key, png)
+        except OSError as e:
+            logger.warning(f"⚠️ Не вдалося зберегти QR-код на диск: {e}")
+    return png
+
+
+def _render_batch(items: Sequence[tuple]) -> List[bytes]:
+    """Runs in worker process: (data, key) pairs -> PNG bytes"""
+    return [_load_or_render(data, key) for data, key in items]
+
+
+class QRRenderService:
+    """Renders QR codes in a process pool; batches amortize inter-process overhead"""
+
+    def __init__(self, workers: int = QR_RENDER_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def start(self):
+        """Fork worker processes early (before DB threads exist)"""
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(render_qr_png, "warm-up")
+        logger.info(f"🖨 QR render pool запущено ({self.workers} процесів)")
+
+    async def render_batch(self, items: Sequence[tuple]) -> List[bytes]:
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        try:
+            return await loop.run_in_executor(pool, _render_batch, list(items))
+        except BrokenProcessPool:
+            # Пул міг уже перезапустити інший запит, що впав разом з цим
+            if self._pool is pool:
+                logger.error("❌ QR render pool зламався, перезапуск")
+                # Зламаний пул теж треба закрити, інакше лишаються його керуючий потік і процеси
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                # Нові процеси форкаються одразу, поки жоден потік цього процесу не рендерить
+                # (fork посеред рендерингу в потоці може успадкувати захоплені блокування)
+                self.start()
+        try:
+            return await loop.run_in_executor(self._get_pool(), _render_batch, list(items))
+        except BrokenProcessPool:
+            return await asyncio.to_thread(_render_batch, list(items))
+
+    async def render(self, data: str, key: str) -> bytes:
+        return (await self.render_batch([(data, key)]))[0]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+renderer = QRRenderService()
+
+
+async def get_qr_png(data: str) -> bytes:
+    """Get PNG from memory cache, disk cache, or render it in the process pool"""
+    key = cache_key(data)
+    png = _png_cache.get(key)
+    if png is None:
+        with profiling.span("render", "qr"):
+            png = await renderer.render(data, key)
+        _png_cache.set(key, png)
+    return png
+
+
+async def prerender_all(batch_size: int = 100) -> int:
+    """
+    Render QR codes for all registered users in batches into the disk cache.
+    Requires QR_CACHE_DIR: the memory cache keeps only QR_CACHE_SIZE codes, the rest would be thrown away
+    """
+    if not QR_CACHE_DIR:
+        raise RuntimeError("QR_CACHE_DIR не задано: без дискового кешу попередня генерація не має сенсу")
+    started = time.monotonic()
+    rendered = 0
+    batch = []
+
+    async def flush():
+        nonlocal rendered
+        pngs = await renderer.render_batch(batch)
+        for (_, key), png in zip(batch, pngs):
+            _png_cache.set(key, png)
+        rendered += len(batch)
+        batch.clear()
+
+    async for (phone,) in async_db.iter_users(("phone",)):
+        if not phone:
+            continue
+        key = cache_key(phone)
+        path = _disk_path(key)
+        if (path and os.path.exists(path)) or _png_cache.get(key, count_miss=False) is not None:
+            continue
+        batch.append((phone, key))
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    logger.info(f"✅ Попередньо згенеровано QR-кодів: {rendered} за {time.monotonic() - started:.1f} с")
+    return rendered
+
+
+async def send_qr(message: Message, data: str, caption: str, reply_markup=None) -> Message:
+    """Send QR photo, reusing Telegram file_id when this QR was already uploaded"""
+    key = cache_key(data)
+    file_id = _file_id_cache.get(key)
+    if file_id:
+        try:
+            return await message.answer_photo(photo=file_id, caption=caption, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            logger.warning(f"⚠️ Кешований file_id QR-коду недійсний, завантажуємо заново: {e}")
+            _file_id_cache.pop(key)
+
+    png = await get_qr_png(data)
+    sent = await message.answer_photo(
+        photo=BufferedInputFile(png, filename="qr_code.png"),
+        caption=caption,
+        reply_markup=reply_markup,
+    )
+    if sent.photo:
+        _file_id_cache.set(key, sent.photo[-1].file_id)
+    return sent
+
+
+if __name__ == "__main__":
+    # CLI: python qr.py prerender
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != "prerender":
+        print("Використання: python qr.py prerender")
+        sys.exit(1)
+    if not QR_CACHE_DIR:
+        print("❌ Задайте QR_CACHE_DIR: попередньо згенеровані QR-коди зберігаються на диску")
+        sys.exit(1)
+    renderer.start()
+    try:
+        asyncio.run(prerender_all())
+    finally:
+        renderer.shutdown()
+        async_db.shutdown()
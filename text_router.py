@@ -0,0 +1,50 @@
+import logging
+from typing import Any, Dict
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class TextRouter:
+    """
+    Routes reply-keyboard buttons by exact message text with one dict lookup.
+
+    All routes are served by a single message handler, which must be
+    registered after the FSM-state and contact handlers so they keep precedence.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, CallableObject] = {}
+
+    def route(self, *texts: str):
+        """Decorator: handle messages whose text equals one of `texts`"""
+        def decorator(callback):
+            handler = CallableObject(callback)
+            for text in texts:
+                if text in self._routes:
+                    raise ValueError(f"Text route already registered: {text!r}")
+                self._routes[text] = handler
+            return callback
+        return decorator
+
+    def handler_name(self, text: str) -> str:
+        handler = self._routes.get(text)
+        return handler.callback.__name__ if handler else "unknown"
+
+    def match(self, message: Message) -> bool:
+        return message.text in self._routes
+
+    async def dispatch(self, message: Message, **data: Any):
+        # Handler gets only the kwargs it declares (message, state, bot, ...), like a normal aiogram handler
+        return await self._routes[message.text].call(message, **data)
+
+    def register(self, dp: Dispatcher):
+        """Attach router to dispatcher (call after all other message handlers)"""
+        dp.message.register(self.dispatch, self.match)
+        logger.info(f"✅ Text router: {len(self._routes)} кнопок")
+
+    def __len__(self) -> int:
+        return len(self._routes)
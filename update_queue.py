@@ -0,0 +1,271 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Any, Dict, List, Optional, Union
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.dispatcher import DEFAULT_BACKOFF_CONFIG
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))  # на всі шарди разом
+UPDATE_QUEUE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_QUEUE_DRAIN_TIMEOUT", "10"))
+RETRY_AFTER_SECONDS = 5  # підказка Telegram, коли черга переповнена
+LAG_EWMA_ALPHA = 0.1
+
+RawOrUpdate = Union[Dict[str, Any], Update]
+
+
+def chat_key(update: RawOrUpdate) -> int:
+    """Ordering key of update (raw dict or Update): chat id, else user id, else update id"""
+    if isinstance(update, Update):
+        event = update.event
+        chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+        if chat:
+            return chat.id
+        user = getattr(event, "from_user", None) or getattr(event, "user", None)
+        return user.id if user else update.update_id
+
+    for field, payload in update.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+class _Shard:
+    """Queue of one worker + lag stats (time from enqueue to start of handling)"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.processed = 0
+        self.last_lag = 0.0
+        self.avg_lag = 0.0
+        self.max_lag = 0.0
+
+    def record_lag(self, lag: float):
+        self.last_lag = lag
+        self.avg_lag += LAG_EWMA_ALPHA * (lag - self.avg_lag)
+        self.max_lag = max(self.max_lag, lag)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.queue.qsize(),
+            "processed": self.processed,
+            "last_lag": round(self.last_lag, 4),
+            "avg_lag": round(self.avg_lag, 4),
+            "max_lag": round(self.max_lag, 4),
+        }
+
+
+class UpdateQueue:
+    """
+    Sharded update scheduler: bounded queues drained by one worker task per shard.
+
+    Every chat is pinned to one shard, so updates of one chat are handled in order
+    (the contact is saved before the next "📱 Мій QR-код" tap) while different chats
+    are handled in parallel. Used by both webhook (QueuedRequestHandler) and polling
+    (run_polling) entry points.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = UPDATE_WORKERS,
+                 maxsize: int = UPDATE_QUEUE_SIZE, **data: Any):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.data = data
+        self.workers = workers
+        self.shard_size = max(1, maxsize // workers)
+        self._shards: List[_Shard] = []
+        self._tasks: List[asyncio.Task] = []
+        self.rejected = 0
+
+    def start(self):
+        self._shards = [_Shard(self.shard_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(shard)) for shard in self._shards]
+        logger.info(f"📥 Черга апдейтів: {self.workers} воркерів, до {self.capacity} апдейтів")
+
+    @property
+    def capacity(self) -> int:
+        return self.shard_size * self.workers
+
+    @property
+    def depth(self) -> int:
+        return sum(shard.queue.qsize() for shard in self._shards)
+
+    @property
+    def processed(self) -> int:
+        return sum(shard.processed for shard in self._shards)
+
+    def _shard_for(self, update: RawOrUpdate) -> _Shard:
+        return self._shards[chat_key(update) % self.workers]
+
+    def put_nowait(self, update: RawOrUpdate) -> bool:
+        """Enqueue update; False if its shard is full (webhook asks Telegram to retry)"""
+        try:
+            self._shard_for(update).queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        return True
+
+    async def put(self, update: RawOrUpdate):
+        """Enqueue update, waiting while its shard is full (polling just slows down)"""
+        await self._shard_for(update).queue.put((time.monotonic(), update))
+
+    async def _handle(self, update: RawOrUpdate) -> Any:
+        if isinstance(update, Update):
+            return await self.dispatcher.feed_update(self.bot, update, **self.data)
+        return await self.dispatcher.feed_raw_update(self.bot, update, **self.data)
+
+    async def _worker(self, shard: _Shard):
+        while True:
+            enqueued_at, update = await shard.queue.get()
+            shard.record_lag(time.monotonic() - enqueued_at)
+            try:
+                result = await self._handle(update)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(self.bot, result)
+            except Exception as e:
+                logger.error(f"❌ Помилка обробки апдейту {chat_key(update)}: {e}", exc_info=True)
+            finally:
+                shard.processed += 1
+                shard.queue.task_done()
+
+    async def stop(self, timeout: float = UPDATE_QUEUE_DRAIN_TIMEOUT):
+        """Wait for queued updates (up to timeout), then stop workers"""
+        if self._shards:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(shard.queue.join() for shard in self._shards)), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Черга апдейтів не спорожніла за {timeout} с, втрачено: {self.depth}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "capacity": self.capacity,
+            "workers": self.workers,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "max_lag": round(max((shard.max_lag for shard in self._shards), default=0.0), 4),
+            "shards": [shard.stats() for shard in self._shards],
+        }
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler that puts updates into UpdateQueue and answers Telegram at once.
+
+    When the queue is full it answers 503 with Retry-After, so Telegram redelivers
+    the update later instead of it being dropped.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, queue: Optional[UpdateQueue] = None,
+                 secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=False,
+                         secret_token=secret_token, **data)
+        self.queue = queue or UpdateQueue(dispatcher, bot, **data)
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._handle_start)
+        super().register(app, path=path, **kwargs)
+
+    async def _handle_start(self, app: web.Application) -> None:
+        self.queue.start()
+
+    async def _handle_request(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.queue.put_nowait(update):
+            logger.warning(f"⚠️ Черга апдейтів переповнена ({self.queue.depth}), апдейт {update.get('update_id')} відхилено")
+            return web.Response(status=503, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        # Спершу обробляємо те, що вже в черзі, і лише потім закриваємо сесію бота
+        await self.queue.stop()
+        await super().close()
+
+
+async def _listen(bot: Bot, queue: UpdateQueue, polling_timeout: int, allowed_updates: Optional[List[str]],
+                  backoff_config: BackoffConfig):
+    backoff = Backoff(config=backoff_config)
+    get_updates = GetUpdates(timeout=polling_timeout, allowed_updates=allowed_updates)
+    # Запит має чекати довше за long polling, інакше буде хибний timeout
+    request_timeout = int(bot.session.timeout + polling_timeout) if bot.session.timeout else None
+    failed = False
+    while True:
+        try:
+            updates = await bot(get_updates, request_timeout=request_timeout)
+        except Exception as e:
+            failed = True
+            logger.error(f"❌ Не вдалося отримати апдейти: {type(e).__name__}: {e}, повтор через {backoff.next_delay:.1f} с")
+            await backoff.asleep()
+            continue
+        if failed:
+            logger.info("✅ З'єднання з Telegram відновлено")
+            backoff.reset()
+            failed = False
+        for update in updates:
+            await queue.put(update)
+            get_updates.offset = update.update_id + 1
+
+
+async def run_polling(dispatcher: Dispatcher, bot: Bot, queue: Optional[UpdateQueue] = None,
+                      polling_timeout: int = 10, backoff_config: BackoffConfig = DEFAULT_BACKOFF_CONFIG,
+                      handle_signals: bool = True, **kwargs: Any):
+    """
+    Like Dispatcher.start_polling, but updates are handled by UpdateQueue workers
+    instead of one unordered task per update.
+
+    Startup/shutdown events, SIGINT/SIGTERM and closing the bot session behave as in start_polling.
+    """
+    queue = queue or UpdateQueue(dispatcher, bot)
+    workflow_data = {"dispatcher": dispatcher, "bots": (bot,), **dispatcher.workflow_data, **kwargs}
+    queue.data.update(workflow_data)
+
+    stop = asyncio.Event()
+    if handle_signals:
+        loop = asyncio.get_running_loop()
+        with suppress(NotImplementedError):  # Windows
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+            loop.add_signal_handler(signal.SIGINT, stop.set)
+
+    await dispatcher.emit_startup(bot=bot, **workflow_data)
+    user = await bot.me()
+    logger.info(f"Run polling for bot @{user.username} id={bot.id}")
+    queue.start()
+    listener = asyncio.create_task(_listen(bot, queue, polling_timeout,
+                                           dispatcher.resolve_used_update_types(), backoff_config))
+    stopper = asyncio.create_task(stop.wait())
+    try:
+        done, _ = await asyncio.wait((listener, stopper), return_when=asyncio.FIRST_COMPLETED)
+        if listener in done:
+            listener.result()  # пробросити неочікувану помилку
+    finally:
+        for task in (listener, stopper):
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        logger.info("Polling stopped")
+        try:
+            await queue.stop()
+            await dispatcher.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
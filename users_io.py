@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Масовий імпорт і експорт гостей у CSV.
+
+Імпорт читає файл потоково пачками по --batch рядків і записує кожну пачку однією
+транзакцією (COPY на PostgreSQL, executemany на SQLite), оновлюючи наявних гостей за user_id.
+Колонки: user_id, phone (обов'язкові), bonus_points, total_spent. Якщо колонки bonus_points
+чи total_spent немає або клітинка порожня, у наявного гостя значення не змінюється (новому - 0).
+
+Експорт пише всіх гостей потоково, не збираючи файл у пам'яті.
+
+Запуск:
+    python users_io.py import guests.csv [--batch 5000] [--delimiter ";"]
+    python users_io.py export users.csv        # "-" - у stdout
+"""
+import argparse
+import csv
+import logging
+import sys
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import db
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ("user_id", "phone")
+DEFAULT_BATCH = 5000
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    """Absent column or empty cell -> None: the guest's current value is kept"""
+    value = (value or "").strip()
+    return int(value) if value else None
+
+
+def _parse_row(row: dict) -> Tuple[int, str, Optional[int], Optional[int]]:
+    phone = (row.get("phone") or "").strip()
+    if not phone:
+        raise ValueError("порожній phone")
+    return (
+        int(row["user_id"]),
+        phone,
+        _optional_int(row.get("bonus_points")),
+        _optional_int(row.get("total_spent")),
+    )
+
+
+def _batches(reader: csv.DictReader, size: int, errors: List[str]) -> Iterator[List[Tuple[int, str, Optional[int], Optional[int]]]]:
+    batch = []
+    for row in reader:
+        try:
+            batch.append(_parse_row(row))
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append(f"рядок {reader.line_num}: {e}")
+            continue
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_users(path: str, batch_size: int = DEFAULT_BATCH, delimiter: str = ",") -> int:
+    db.init_db()
+    errors: List[str] = []
+    imported = 0
+    started = time.perf_counter()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise SystemExit(f"❌ У файлі немає колонок: {', '.join(missing)}")
+        for batch in _batches(reader, batch_size, errors):
+            imported += db.bulk_upsert_users(batch)
+            elapsed = time.perf_counter() - started
+            print(f"  імпортовано {imported} ({imported / elapsed:,.0f} рядків/с)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    for error in errors[:20]:
+        print(f"⚠️ Пропущено {error}", file=sys.stderr)
+    if len(errors) > 20:
+        print(f"⚠️ ... і ще {len(errors) - 20} помилкових рядків", file=sys.stderr)
+    print(f"✅ Імпортовано {imported} гостей за {elapsed:.1f} с ({imported / max(elapsed, 1e-9):,.0f} рядків/с), "
+          f"пропущено {len(errors)}", file=sys.stderr)
+    return imported
+
+
+def export_users(path: str) -> int:
+    started = time.perf_counter()
+    if path == "-":
+        count = db.export_users_csv(sys.stdout)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            count = db.export_users_csv(f)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Експортовано {count} гостей за {elapsed:.1f} с ({count / max(elapsed, 1e-9):,.0f} рядків/с)",
+          file=sys.stderr)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of guests as CSV")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="insert or update guests from CSV")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="rows per transaction")
+    import_parser.add_argument("--delimiter", default=",")
+    export_parser = commands.add_parser("export", help="write all guests to CSV")
+    export_parser.add_argument("path", help='file or "-" for stdout')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        if args.command == "import":
+            import_users(args.path, args.batch, args.delimiter)
+        else:
+            export_users(args.path)
+    finally:
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()